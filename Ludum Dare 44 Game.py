@@ -1,8 +1,29 @@
 import pygame
 import sys
 import os
+import argparse
 import math
 import random
+import collections
+import time
+import json
+import hashlib
+import struct
+import mmap
+import atexit
+import pickle
+import zlib
+import io
+import wave
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import numpy
+except ImportError:
+    numpy = None   # bodies are moved one at a time instead
+
+STARTED = time.perf_counter()   # for timing how long the first frame takes
 
 # CONSTANTS
 # BASIC VISUALS
@@ -13,6 +34,7 @@ TILE_W = PIXEL*14
 TILE_H = PIXEL*14
 FPS = 60
 DEBUG_FPS = 5
+DIRTY_RECTS = False   # only redraw and present the parts of the screen that change
 
 # COLORS
 BLACK = (0, 0, 0)
@@ -45,12 +67,207 @@ ALL = 0
 PLAYER = 1
 ENEMY = 2
 
+# ENTITY KINDS
+BULLETS = 0
+DYING_BULLETS = 1
+COINS = 2
+HOUNDS = 3
+CORPSES = 4
+
 # MISC / UNSORTED
 GRAVITY = 0.4
 TERMINAL_VELOCITY = 15
 
+# COMMAND LINE
+parser = argparse.ArgumentParser(description="Ludum Dare 44 game")
+parser.add_argument("--headless", action="store_true",
+                    help="run the game logic as fast as possible without a window")
+parser.add_argument("--ticks", type=int, default=FPS * 60 * 10,
+                    help="how many ticks a headless run lasts")
+parser.add_argument("--script",
+                    help="file of scripted input for a headless run, instead of the bot")
+parser.add_argument("--seed", type=int, help="seed for the random number generator")
+parser.add_argument("--build-atlas", action="store_true",
+                    help="repack every spritesheet into images/atlas.rgb and quit")
+parser.add_argument("--build-archive", action="store_true",
+                    help="pack the images, sounds, levels and font into assets.pak and quit")
+parser.add_argument("--startup-time", action="store_true",
+                    help="print how long it took to show the first frame")
+parser.add_argument("--record", metavar="PATH",
+                    help="save a replay of the game, which starts straight in without the menu")
+parser.add_argument("--replay", metavar="PATH",
+                    help="play a replay back, in the window or with --headless")
+parser.add_argument("--fast", action="store_true",
+                    help="play a replay back as fast as it'll go instead of in real time")
+parser.add_argument("--seek", type=float, metavar="SECONDS",
+                    help="start a replay this far in")
+args = parser.parse_args()
+if args.seed is not None and not -2**63 <= args.seed < 2**63:
+    parser.error("--seed has to fit in 64 bits, to be saved in a replay")
+
+
+# ASSETS
+class MappedFile:
+    """a file you can hand to pygame for one asset inside the archive
+
+    every read copies out just the bytes asked for, so the asset gets
+    decoded straight out of the map instead of out of a copy of all of it"""
+    def __init__(self, view):
+        self.view = view
+        self.position = 0
+
+    def read(self, size=-1):
+        start = self.position
+        end = len(self.view)
+        if size is not None and size >= 0:
+            end = min(start + size, end)
+        self.position = max(start, end)
+        return self.view[start:end].tobytes()
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += len(self.view)
+        self.position = max(offset, 0)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        pass
+
+
+class AssetArchive:
+    """every asset packed into one file, which gets mapped into memory
+
+    the file is a header, a json index of where each asset is and then the
+    assets back to back.  nothing's read until an asset is decoded, and then
+    only the pages it's on.  a loose file that's changed since it was packed
+    wins over the packed one, so assets can be edited without repacking,
+    and without an archive at all everything comes from the folders"""
+    PATH = "assets.pak"
+    MAGIC = b"PAK"
+    VERSION = 1
+    HEADER = struct.Struct("<3sBI")   # magic, version, index size
+    PACKED = {"images": (".png",),
+              "sounds": (".wav", ".ogg"),
+              "levels": (".json",),
+              "": (".ttf",)}   # the folders and what's packed from them
+
+    def __init__(self, path):
+        self.index = {}   # path: [offset, size, modified]
+        self.view = None
+        try:
+            with open(path, "rb") as file:
+                self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):   # there's no archive, or it's empty
+            return
+
+        view = memoryview(self.map)
+        if len(view) < self.HEADER.size:
+            return
+
+        magic, version, index_size = self.HEADER.unpack_from(view)
+        if magic == self.MAGIC and version == self.VERSION:
+            self.data_start = self.HEADER.size + index_size
+            self.index = json.loads(view[self.HEADER.size:self.data_start].tobytes())
+            self.view = view
+
+    def find(self, path):
+        """returns a packed asset's spot in the map, or None to use the loose file"""
+        entry = self.index.get(path.replace(os.sep, "/"))
+        if entry is None:
+            return None
+
+        offset, size, modified = entry
+        try:
+            stat = os.stat(path)
+            if stat.st_size != size or stat.st_mtime_ns != modified:
+                return None
+        except OSError:
+            pass   # only the archive has it
+
+        start = self.data_start + offset
+        return self.view[start:start + size]
+
+    def stamp(self, path):
+        """returns the size and modified time of the asset that'd be used"""
+        try:
+            stat = os.stat(path)
+            return [stat.st_size, stat.st_mtime_ns]
+        except OSError:
+            entry = self.index.get(path.replace(os.sep, "/"))
+            if entry is None:
+                raise
+            return entry[1:]
+
+    def read(self, path):
+        """returns all of an asset, as a view into the map if it's packed"""
+        view = self.find(path)
+        if view is not None:
+            return view
+
+        with open(path, "rb") as file:
+            return file.read()
+
+    def open(self, path):
+        """returns something file-like to decode an asset from"""
+        view = self.find(path)
+        if view is not None:
+            return MappedFile(view)
+
+        return open(path, "rb")
+
+    @classmethod
+    def build(cls, path):
+        """packs every asset into a new archive, returning how many there were"""
+        asset_paths = []
+        for folder, extensions in cls.PACKED.items():
+            for name in sorted(os.listdir(folder or os.curdir)):
+                asset_path = os.path.join(folder, name) if folder else name
+                if name.endswith(extensions) and os.path.isfile(asset_path):
+                    asset_paths.append(asset_path)
+
+        index = {}
+        offset = 0
+        for asset_path in asset_paths:
+            stat = os.stat(asset_path)
+            index[asset_path.replace(os.sep, "/")] = [offset, stat.st_size, stat.st_mtime_ns]
+            offset += stat.st_size
+
+        packed_index = json.dumps(index, separators=(",", ":")).encode()
+        with open(path + ".tmp", "wb") as file:
+            file.write(cls.HEADER.pack(cls.MAGIC, cls.VERSION, len(packed_index)))
+            file.write(packed_index)
+            for asset_path in asset_paths:
+                with open(asset_path, "rb") as asset:
+                    file.write(asset.read())
+        os.replace(path + ".tmp", path)
+        return len(asset_paths)
+
+
+if args.build_archive:
+    print("packed", AssetArchive.build(AssetArchive.PATH), "assets into", AssetArchive.PATH)
+    sys.exit()
+
+assets = AssetArchive(AssetArchive.PATH)
+loader = ThreadPoolExecutor(2, "loader")   # decodes assets while the menu's already up
+
+
+# REPLAYS
+replay = None   # the game being recorded or played back, if it is, made once Replay is
+seed = args.seed if args.seed is not None else random.getrandbits(63)
+rng = random.Random(seed)   # every roll the game makes, so a replay can make them again
+
 # INITIALIZATION
 os.environ['SDL_VIDEO_CENTERED'] = '1'
+if args.headless:
+    # there's still a display surface to convert images against, it's just
+    # never shown
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    os.environ['SDL_AUDIODRIVER'] = 'dummy'
 
 pygame.mixer.init(44100, -16, 2, 512)
 pygame.mixer.set_num_channels(16)
@@ -59,24 +276,33 @@ postSurf = pygame.display.set_mode((SCRN_W, SCRN_H))
 
 clock = pygame.time.Clock()
 DEBUG_FONT = pygame.font.SysFont("Tahoma", 10)
-FONT = pygame.font.Font("m5x7.ttf", 64)
-FONT_SMALL = pygame.font.Font("m5x7.ttf", 32)
+FONT = pygame.font.Font(assets.open("m5x7.ttf"), 64)
+FONT_SMALL = pygame.font.Font(assets.open("m5x7.ttf"), 32)
+
+
+first_frame = None   # seconds from starting up to the first frame shown
 
 
 def update(slow_down=False):
-    """should be run once every frame"""
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            pygame.quit()
-            sys.exit()
-
-    pygame.display.flip()
-    postSurf.fill(BLACK)
+    """should be run once every frame, after drawing it"""
+    global first_frame
+
+    dirty.present()
+    music.feed()
+    if first_frame is None:
+        first_frame = time.perf_counter() - STARTED
+        if args.startup_time:
+            print("first frame after %.0fms" % (first_frame * 1000))
+
     if slow_down:
         clock.tick(DEBUG_FPS)
+    elif args.fast:
+        clock.tick()
     else:
         clock.tick(FPS)
 
+    user_input.poll()   # last, so it's as fresh as it can be for the next frame
+
 
 def debug(num, *args):
     """renders a string containing all the arguments
@@ -86,10 +312,11 @@ def debug(num, *args):
     for arg in args:
         string += repr(arg) + " "
     text = DEBUG_FONT.render(string, False, WHITE, BLACK)
-    postSurf.blit(text, (10, num * 10 + 100))
+    dirty.blit(postSurf, text, (10, num * 10 + 100))
 
 
 def debug_point(pos):
+    dirty.clear(pygame.Rect(pos[0] - 3, pos[1] - 3, 7, 7))
     pygame.draw.circle(postSurf, YELLOW, pos, 3)
 
 
@@ -148,15 +375,239 @@ def body_distance(body1, body2):
     return distance(body1.pos_center(), body2.pos_center())
 
 
-def load_image(path):
-    image = pygame.image.load(os.path.join("images", path))
+def rect_minus(rect, other):
+    """returns the parts of rect that aren't covered by other"""
+    if not rect.colliderect(other):
+        return [rect]
+
+    clip = rect.clip(other)
+    parts = []
+    if clip.top > rect.top:
+        parts.append(pygame.Rect(rect.x, rect.y, rect.w, clip.top - rect.top))
+    if clip.bottom < rect.bottom:
+        parts.append(pygame.Rect(rect.x, clip.bottom, rect.w, rect.bottom - clip.bottom))
+    if clip.left > rect.left:
+        parts.append(pygame.Rect(rect.x, clip.y, clip.left - rect.left, clip.h))
+    if clip.right < rect.right:
+        parts.append(pygame.Rect(clip.right, clip.y, rect.right - clip.right, clip.h))
+
+    return parts
+
+
+def load_image(path, colorkey=None):
+    image = pygame.image.load(assets.open(os.path.join("images", path)), path)
+    image = image.convert()   # cheaper before scaling
     width = image.get_width() * PIXEL
     height = image.get_height() * PIXEL
     resized = pygame.transform.scale(image, (width, height))
-    resized.convert()
+    if colorkey is not None:
+        resized.set_colorkey(colorkey)
     return resized
 
 
+class DirtyRects:
+    """keeps track of which parts of the screen were drawn over
+
+    the screen is split into square cells, and while the background holds
+    still only the cells drawn in on this frame and the last get restored
+    and sent to the display.  a cell gets its background back the first
+    time it's drawn in on a frame, so everything in the damaged cells has
+    been drawn exactly once, however many things overlap there.  once most
+    of the screen is damaged it's all sent anyway.  anything covering the
+    whole screen calls overlay() so the next frame starts clean"""
+    CELL = 25   # in screen pixels
+    MAX_DAMAGED = 0.5   # of the screen, past which the whole thing is sent
+
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.screen = pygame.Rect(0, 0, SCRN_W, SCRN_H)
+        self.cols = -(-SCRN_W // self.CELL)
+        self.cell_rects = [self.screen.clip(col * self.CELL, row * self.CELL, self.CELL, self.CELL)
+                           for row in range(-(-SCRN_H // self.CELL)) for col in range(self.cols)]
+        self.cells = set()   # drawn in on this frame, as row * cols + col
+        self.last_cells = set()
+
+        self.background = None
+        self.background_pos = None
+        self.redraw = True   # the next restore has to redraw everything
+        self.flip = True   # this frame has to present the whole screen
+        self.clean = False   # the whole background was redrawn this frame
+
+        self.frame = 0
+        self.pixels = 0   # pixels sent to the display last frame
+
+    def add(self, rect):
+        """remembers a rect that was completely drawn over, returns it"""
+        if self.enabled:
+            self.touch(self.screen.clip(rect), True)
+        return rect
+
+    def clear(self, rect):
+        """gets a rect ready to be drawn over, returns it
+
+        any cell it's the first thing on this frame gets its background
+        restored first, so see-through pixels don't show stale things"""
+        if not self.enabled:
+            return rect
+
+        rect = self.screen.clip(rect)
+        self.touch(rect, False)
+        return rect
+
+    def touch(self, rect, drawn):
+        """marks the cells under rect, restoring the ones new this frame
+
+        if rect's already drawn, only the rest of those cells is restored"""
+        if not rect:
+            return
+
+        cell_size = self.CELL
+        for row in range(rect.top // cell_size, (rect.bottom - 1) // cell_size + 1):
+            start = row * self.cols
+            for cell in range(start + rect.left // cell_size,
+                              start + (rect.right - 1) // cell_size + 1):
+                if cell in self.cells:
+                    continue
+
+                self.cells.add(cell)
+                if self.clean or cell in self.last_cells:
+                    continue   # its background's already back
+
+                if drawn:
+                    for part in rect_minus(self.cell_rects[cell], rect):
+                        self.restore_rect(part)
+                else:
+                    self.restore_rect(self.cell_rects[cell])
+
+    def blit(self, surf, image, pos):
+        """blits an image, remembering where it went"""
+        if self.enabled:
+            self.clear(image.get_rect(topleft=(int(pos[0]), int(pos[1]))))
+        return surf.blit(image, pos)
+
+    def overlay(self):
+        """call after drawing over the whole screen"""
+        self.flip = True
+        self.redraw = True
+
+    def spans(self, cells):
+        """returns rects covering cells, each run of them along a row in one"""
+        rects = []
+        last = None
+        for cell in sorted(cells):
+            if rects and cell == last + 1 and cell % self.cols:
+                rects[-1].union_ip(self.cell_rects[cell])
+            else:
+                rects.append(self.cell_rects[cell].copy())
+            last = cell
+
+        return rects
+
+    def damaged(self):
+        """returns non-overlapping rects covering everything that changed
+        since the last presented frame
+
+        they can't overlap so that see-through things drawn over them
+        don't end up drawn twice in the same place"""
+        return self.spans(self.cells | self.last_cells)
+
+    def restore_rect(self, rect):
+        pos = self.background_pos
+        if not self.background.get_rect(topleft=pos).contains(rect):
+            postSurf.fill(BLACK, rect)
+        postSurf.blit(self.background, rect, rect.move(-pos[0], -pos[1]))
+
+    def restore(self, surf, background, pos):
+        """draws the background, only under last frame's rects if possible"""
+        if not self.enabled:
+            surf.blit(background, pos)
+
+        elif self.redraw or background is not self.background or pos != self.background_pos:
+            self.background = background
+            self.background_pos = pos
+            self.redraw = False
+            self.flip = True
+            self.clean = True
+            surf.fill(BLACK)
+            surf.blit(background, pos)
+
+        else:
+            for rect in self.spans(self.last_cells):
+                self.restore_rect(rect)
+
+    def present(self):
+        """sends the frame to the display"""
+        if not self.enabled:
+            pygame.display.flip()
+            postSurf.fill(BLACK)
+            self.pixels = SCRN_W * SCRN_H
+            return
+
+        damaged = self.cells | self.last_cells
+        if self.flip or len(damaged) > len(self.cell_rects) * self.MAX_DAMAGED:
+            pygame.display.flip()
+            self.pixels = SCRN_W * SCRN_H
+        else:
+            rects = self.spans(damaged)
+            pygame.display.update(rects)
+            self.pixels = sum(rect.w * rect.h for rect in rects)
+
+        self.flip = False
+        self.clean = False
+        self.last_cells = self.cells
+        self.cells = set()
+        self.frame += 1
+
+
+class Timestep:
+    """runs the game's ticks at a fixed rate, however fast frames get drawn
+
+    leftover time carries over into the next frame, and alpha says how far
+    between the last two ticks a frame is so things can be drawn in between.
+    past MAX_STEPS ticks in one frame it stops catching up and slows down.
+    a fixed timestep ignores the clock and runs one tick every frame"""
+    STEP = 1 / FPS
+    MAX_STEPS = 5
+
+    def __init__(self, fixed=False):
+        self.tick = 0
+        self.accumulator = 0
+        self.alpha = 1
+        self.last_time = None
+        self.fixed = fixed
+
+    def reset(self):
+        """forgets the time spent outside of a ticking loop"""
+        self.last_time = None
+
+    def steps(self):
+        """returns how many ticks have to run this frame"""
+        if self.fixed:
+            return 1
+
+        now = time.perf_counter()
+        if self.last_time is None:
+            self.accumulator = self.STEP
+        else:
+            self.accumulator += now - self.last_time
+        self.last_time = now
+
+        steps = int(self.accumulator / self.STEP)
+        if steps > self.MAX_STEPS:
+            steps = self.MAX_STEPS
+            self.accumulator = steps * self.STEP
+
+        self.accumulator -= steps * self.STEP
+        self.alpha = self.accumulator / self.STEP
+        return steps
+
+    def ticks(self):
+        """goes through each tick that has to run this frame"""
+        for _ in range(self.steps()):
+            self.tick += 1
+            yield self.tick
+
+
 class ScreenFade:
     FADE_STEP = 1
 
@@ -169,6 +620,15 @@ class ScreenFade:
         self.fade_out = False
         self.target = 0
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["surf"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.surf = pygame.Surface((self.w, self.h))
+
     def fade_to_black(self):
         self.fade_in = False
         self.fade_out = True
@@ -204,23 +664,35 @@ class ScreenFade:
                 self.transparency = self.target
                 self.fade_in = False
 
-        self.surf.set_alpha(self.transparency)
-        postSurf.blit(self.surf, (0, 0))
+    def draw(self):
+        if self.transparency:
+            self.surf.set_alpha(self.transparency)
+            postSurf.blit(self.surf, (0, 0))
+            dirty.overlay()
 
 
 class Pinhole:
-    """inverted circle of black"""
+    """inverted circle of black
+
+    masks are drawn small, scaled up once and kept in a little LRU cache
+    keyed by (radius, center), so a frame only costs a single blit"""
     LOW_PULSE = 55
     HIGH_PULSE = 65
     SWITCH_DIFF = 0.658
+    CACHE_SIZE = 16
 
     def __init__(self):
         self.center_pos = (0, 0)
         self.w = int(SCRN_W / PIXEL)
         self.h = int(SCRN_H / PIXEL)
         self.radius = 100
-        self.surf = pygame.Surface((self.w, self.h))
-        self.surf.set_colorkey(GREEN)
+        self.alpha = None
+
+        self.masks = collections.OrderedDict()
+        self.mask_key = None
+        self.mask = None
+        self.drawn = (None, None)   # (mask, alpha) put on screen last frame
+        self.drawn_frame = -1
 
         self.contracting = False
         self.breathing = False
@@ -228,20 +700,94 @@ class Pinhole:
         self.low_radius = 100
         self.high_radius = 100
 
+    def __getstate__(self):
+        """leaves the masks out, they're only what it looked like"""
+        state = self.__dict__.copy()
+        for name in ("masks", "mask_key", "mask", "drawn", "drawn_frame"):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.masks = collections.OrderedDict()
+        self.mask_key = None
+        self.mask = None
+        self.drawn = (None, None)
+        self.drawn_frame = -1
+
     def set_position(self, pos):
         self.center_pos = (int(pos[0] / PIXEL), int(pos[1] / PIXEL))
 
     def set_radius(self, radius):
         self.radius = radius
-        self.surf.fill(BLACK)
-        pygame.draw.circle(self.surf, GREEN, self.center_pos, int(radius))
+
+    def update_mask(self):
+        key = (int(self.radius), self.center_pos)
+        if key != self.mask_key:
+            self.mask_key = key
+            self.mask = self.get_mask(key)
+
+    def covers_screen(self, key):
+        """returns whether the hole is big enough to show the whole screen"""
+        radius, (x, y) = key
+        far_x = max(x, self.w - 1 - x)
+        far_y = max(y, self.h - 1 - y)
+        return far_x ** 2 + far_y ** 2 < (radius - 1) ** 2
+
+    def get_mask(self, key):
+        """returns the full size mask for a key, building it if needed
+
+        returns None if the mask would be completely see-through"""
+        if key in self.masks:
+            self.masks.move_to_end(key)
+            return self.masks[key]
+
+        if self.covers_screen(key):
+            mask = None
+        else:
+            small = pygame.Surface((self.w, self.h))
+            small.fill(BLACK)
+            pygame.draw.circle(small, GREEN, key[1], key[0])
+            mask = pygame.transform.scale(small, (SCRN_W, SCRN_H)).convert()
+            mask.set_colorkey(GREEN)
+
+        self.masks[key] = mask
+        if len(self.masks) > self.CACHE_SIZE:
+            self.masks.popitem(last=False)
+
+        return mask
 
     def draw(self):
-        surface = pygame.transform.scale(self.surf, (SCRN_W, SCRN_H))
-        postSurf.blit(surface, (0, 0))
+        self.update_mask()
+        mask = self.mask
+        alpha = self.alpha if mask else None
+
+        if dirty.enabled and not dirty.flip:
+            if self.drawn_frame != dirty.frame - 1:
+                self.drawn = (None, None)
+
+            if (mask, alpha) != self.drawn:
+                # the old mask is still on screen everywhere that wasn't
+                # drawn over, so the new one waits for next frame's redraw
+                dirty.redraw = True
+                mask, alpha = self.drawn
+
+            if mask:
+                if mask.get_alpha() != alpha:
+                    mask.set_alpha(alpha)
+                for rect in dirty.damaged():
+                    postSurf.blit(mask, rect, rect)
+
+        elif mask:
+            if mask.get_alpha() != alpha:
+                mask.set_alpha(alpha)
+            postSurf.blit(mask, (0, 0))
+
+        self.drawn = (mask, alpha)
+        self.drawn_frame = dirty.frame
 
     def set_alpha(self, value):
-        self.surf.set_alpha(value)
+        self.alpha = value
 
     def breathe(self, low_radius, high_radius):
         self.low_radius = low_radius
@@ -277,55 +823,234 @@ class Pinhole:
                 self.radius *= 1.1
 
         self.set_radius(self.radius)
-        self.draw()
 
 
-class Spritesheet:
-    """stores a spritesheet made of all of a thing's animations"""
-    def __init__(self, sheet_path, frame_w, frame_h, frame_counts):
-        self.surface = load_image(sheet_path)
+class Atlas:
+    """every spritesheet's frames, packed together into one image
+
+    the frames get cut out of the sheets, repeats kept only once, and packed
+    in shelves at their original size, then scaled up by PIXEL.  the pixels
+    are saved raw into images/atlas.rgb, so there's no png to decode, with
+    atlas.json saying where every sheet's frames ended up.  starting up is
+    then one read and one convert instead of all of that for every sheet.
+    the json keeps every sheet's size and modified time, like the asset
+    archive does, so it's repacked when one changes"""
+    IMAGE = os.path.join("images", "atlas.rgb")
+    MANIFEST = os.path.join("images", "atlas.json")
+    VERSION = 2
+    MIN_W = 256   # in the sheets' own pixels, before scaling by PIXEL
+
+    def __init__(self, sheets):
+        self.sheets = sheets   # file name: (frame_w, frame_h)
+        self.surface = None
+        self.manifest = None
+        self.loading = None
+
+    def start(self):
+        """loads on the loader's threads, frames() waits for it to finish"""
+        self.loading = loader.submit(self.load)
+
+    def stamps(self):
+        return {sheet_path: assets.stamp(os.path.join("images", sheet_path))
+                for sheet_path in self.sheets}
+
+    def load(self, rebuild=False):
+        stamps = self.stamps()
+        manifest = None
+        if not rebuild:
+            try:
+                with open(self.MANIFEST) as file:
+                    manifest = json.load(file)
+                if (manifest["version"] != self.VERSION or manifest["pixel"] != PIXEL
+                        or manifest["stamps"] != stamps):
+                    manifest = None
+                else:
+                    with open(self.IMAGE, "rb") as file:
+                        image = pygame.image.frombytes(file.read(), manifest["size"], "RGB")
+            except (OSError, ValueError, KeyError, pygame.error):
+                manifest = None
+
+        if manifest is None:
+            image, manifest = self.build(stamps)
+            try:
+                with open(self.IMAGE, "wb") as file:
+                    file.write(pygame.image.tobytes(image, "RGB"))
+                with open(self.MANIFEST, "w") as file:
+                    json.dump(manifest, file, separators=(",", ":"))
+            except (OSError, pygame.error):
+                pass   # it's packed again next time, that's all
+
+        self.surface = image.convert()
         self.surface.set_colorkey(GREEN)
+        self.manifest = manifest["sheets"]
+
+    def build(self, stamps):
+        """packs the sheets, returning the scaled image and its manifest"""
+        cells = []   # (frame_w, frame_h, surface, positions), one per unique frame
+        unique = {}
+        sheets = {}
+        for sheet_path, (frame_w, frame_h) in self.sheets.items():
+            surface = pygame.image.load(assets.open(os.path.join("images", sheet_path)), sheet_path)
+            anims = []
+            for anim_id in range(surface.get_width() // frame_w):
+                anim = []
+                for frame in range(surface.get_height() // frame_h):
+                    cut = surface.subsurface((anim_id*frame_w, frame*frame_h, frame_w, frame_h))
+                    key = (frame_w, frame_h, pygame.image.tobytes(cut, "RGB"))
+                    if key not in unique:
+                        unique[key] = [0, 0]
+                        cells.append((frame_w, frame_h, cut, unique[key]))
+                    anim.append(unique[key])
+                anims.append(anim)
+            sheets[sheet_path] = {"frame_size": [frame_w, frame_h], "frames": anims}
+
+        width = max([self.MIN_W] + [cell[0] for cell in cells])
+        cells.sort(key=lambda cell: (-cell[1], -cell[0]))
+        x = y = shelf_h = 0
+        for frame_w, frame_h, cut, position in cells:
+            if x + frame_w > width:
+                x = 0
+                y += shelf_h
+                shelf_h = 0
+            position[0] = x
+            position[1] = y
+            x += frame_w
+            shelf_h = max(shelf_h, frame_h)
+
+        image = pygame.Surface((width, y + shelf_h))
+        image.fill(GREEN)
+        for frame_w, frame_h, cut, position in cells:
+            image.blit(cut, position)
+        image = pygame.transform.scale(image, (width * PIXEL, (y + shelf_h) * PIXEL))
+
+        return image, {"version": self.VERSION, "pixel": PIXEL, "stamps": stamps,
+                       "size": list(image.get_size()), "sheets": sheets}
+
+    def frames(self, sheet_path, frame_w, frame_h):
+        """returns a sheet's frames as [anim_id][frame], or None if it isn't packed"""
+        if self.loading is not None:
+            self.loading.result()
+            self.loading = None
+
+        sheet = self.manifest.get(sheet_path)
+        if sheet is None or sheet["frame_size"] != [frame_w, frame_h]:
+            return None
+
+        size = (PIXEL*frame_w, PIXEL*frame_h)
+        return tuple(tuple(self.surface.subsurface((x*PIXEL, y*PIXEL), size) for x, y in anim)
+                     for anim in sheet["frames"])
+
+
+atlas = Atlas({"player.png": (6, 9),
+               "shadowhound.png": (11, 8),
+               "fairy.png": (5, 6),
+               "player_bullet.png": (4, 4),
+               "coin.png": (7, 7),
+               "underworld_king.png": (32, 32),
+               "portal_frame.png": (56, 44)})
+if args.build_atlas:
+    atlas.load(True)
+    print("packed", len(atlas.sheets), "sheets into", Atlas.IMAGE)
+    pygame.quit()
+    sys.exit()
+atlas.start()
 
-        self.full_w = self.surface.get_width()
-        self.full_h = self.surface.get_height()
 
+class Spritesheet:
+    """stores a spritesheet made of all of a thing's animations
+
+    every frame is cut out once, the first time the sheet is used, so
+    looking one up after that is just indexing frames[anim_id][frame].
+    sheets in the atlas get their frames from there, waiting for it to
+    finish loading if it hasn't, instead of loading their own image"""
+    sheets = {}   # sheet_path: sheet, to find them again by name
+
+    def __init__(self, sheet_path, frame_w, frame_h, frame_counts):
+        Spritesheet.sheets[sheet_path] = self
+        self.sheet_path = sheet_path
         self.frame_w = PIXEL*frame_w
         self.frame_h = PIXEL*frame_h
-        self.anim_count = int(self.full_w / frame_w)
         self.frame_counts = frame_counts
         self.z_height = 0
 
+        self.loaded = None   # the frames, once they're cut out
+        self.flips = {}   # (anim_id, frame, flip_x, flip_y): surface
+        self.alpha = None
+
+    @property
+    def frames(self):
+        if self.loaded is None:
+            self.load()
+        return self.loaded
+
+    @property
+    def anim_count(self):
+        return len(self.frames)
+
+    def load(self):
+        frames = atlas.frames(self.sheet_path, self.frame_w // PIXEL, self.frame_h // PIXEL)
+        if frames is None:
+            surface = load_image(self.sheet_path, GREEN)
+            anim_count = int(surface.get_width() / self.frame_w)
+            rows = int(surface.get_height() / self.frame_h)
+            frames = tuple(tuple(self.cut_frame(surface, anim_id, frame) for frame in range(rows))
+                           for anim_id in range(anim_count))
+
+        self.loaded = frames
+
+    def cut_frame(self, surface, anim_id, frame):
+        x = self.frame_w * anim_id
+        y = self.frame_h * frame
+        return surface.subsurface((x, y, self.frame_w, self.frame_h))
+
     def init_z_height(self, rect):
         self.z_height = self.frame_h - rect.h
 
     def get_frame(self, anim_id, frame):
-        """returns a subsurface containing a frame of an animation"""
-        if anim_id >= self.anim_count:
-            print("get_frame() tried to return a non-existant animation!")
-        elif frame >= self.frame_counts[anim_id]:
-            print("get_frame() tried to return a non-existant frame!")
+        """returns the surface of a frame of an animation"""
+        return self.frames[anim_id][frame]
 
-        x = self.frame_w * anim_id
-        y = self.frame_h * frame
-        return self.surface.subsurface((x, y, self.frame_w, self.frame_h))
+    def flipped(self, anim_id, frame, flip_x=True, flip_y=False):
+        """returns a frame mirrored, made the first time it's asked for"""
+        key = (anim_id, frame, flip_x, flip_y)
+        surface = self.flips.get(key)
+        if surface is None:
+            surface = pygame.transform.flip(self.frames[anim_id][frame], flip_x, flip_y)
+            surface.set_colorkey(GREEN)
+            surface.set_alpha(self.alpha)
+            self.flips[key] = surface
+
+        return surface
+
+    def set_alpha(self, value):
+        """changes the transparency of every frame, flipped ones too"""
+        self.alpha = value
+        for frames in self.frames:
+            for surface in frames:
+                surface.set_alpha(value)
+        for surface in self.flips.values():
+            surface.set_alpha(value)
 
 
 class SpriteInstance:
     """handles all frame and animation stuff for each entity"""
     def __init__(self, sheet):
+        self.sheet = sheet
+        self.reset()
+
+    def reset(self):
+        """starts over at the first frame of the first animation"""
         self.current_frame = 0
         self.current_anim = 0
 
         self.delay = 0
 
-        self.sheet = sheet
-
     def set_frame(self, frame):
         self.current_frame = frame
 
     def get_now_frame(self):
-        """returns a subsurface containing the current frame"""
-        return self.sheet.get_frame(self.current_anim, self.current_frame)
+        """returns the surface of the current frame"""
+        return self.sheet.frames[self.current_anim][self.current_frame]
 
     def next_frame(self):
         self.current_frame += 1
@@ -359,48 +1084,233 @@ class SpriteInstance:
                 self.next_frame()
 
 
+class Voice:
+    """one of the mixer channels sound effects play on, and what's on it"""
+    def __init__(self, channel_id):
+        self.channel = pygame.mixer.Channel(channel_id)
+        self.sound_id = None
+        self.started = 0.0
+
+
 class Soundboard:
-    def __init__(self):
-        self.music_id = 0
-        self.sounds = []
-        self.already_playing = False
+    """every sound effect, decoded on the loader's threads as soon as it's added
 
-    def add(self, file_path):
-        file_path = os.path.join("sounds", file_path)
-        self.sounds.append(pygame.mixer.Sound(file_path))
+    a sound that's needed before it's done gets waited on.  sound effects
+    get every channel from first_channel up, the ones below are music's.
+
+    each sound can only be on so many channels at once, past that the
+    oldest one of it gets cut off to start it again.  when every channel is
+    busy it cuts off the oldest of the least important sounds playing, as
+    long as that's no more important than itself, otherwise it doesn't
+    play.  the same sound asked for more than once in a frame plays once"""
+    MIN_GAP = 1 / FPS   # seconds before the same sound can start again
+
+    def __init__(self, first_channel):
+        self.decoding = []
+        self.sounds = []
+        self.limits = []
+        self.priorities = []
+        self.last_played = []
+        self.voices = [Voice(channel_id) for channel_id
+                       in range(first_channel, pygame.mixer.get_num_channels())]
+
+    def add(self, file_path, limit=2, priority=0):
+        """limit is how many channels it can have, priority is how hard it
+        is for other sounds to take them off it"""
+        file = assets.open(os.path.join("sounds", file_path))
+        self.decoding.append(loader.submit(pygame.mixer.Sound, file))
+        self.sounds.append(None)
+        self.limits.append(limit)
+        self.priorities.append(priority)
+        self.last_played.append(-self.MIN_GAP)
+
+    def get(self, sound_id):
+        sound = self.sounds[sound_id]
+        if sound is None:
+            sound = self.decoding[sound_id].result()
+            self.sounds[sound_id] = sound
+
+        return sound
+
+    def find_voice(self, sound_id):
+        """returns the channel the sound should play on, or None"""
+        oldest_same = None
+        same_count = 0
+        free = None
+        weakest = None
+        for voice in self.voices:
+            if not voice.channel.get_busy():
+                if free is None:
+                    free = voice
+            elif voice.sound_id == sound_id:
+                same_count += 1
+                if oldest_same is None or voice.started < oldest_same.started:
+                    oldest_same = voice
+            elif weakest is None or (self.priorities[voice.sound_id], voice.started) \
+                    < (self.priorities[weakest.sound_id], weakest.started):
+                weakest = voice
+
+        if same_count >= self.limits[sound_id]:
+            return oldest_same
+        if free:
+            return free
+        if weakest and self.priorities[weakest.sound_id] <= self.priorities[sound_id]:
+            return weakest
+        return oldest_same
 
     def play(self, sound_id, loops=0):
-        self.sounds[sound_id].play(loops)
+        now = time.perf_counter()
+        if now - self.last_played[sound_id] < self.MIN_GAP:
+            return
+
+        voice = self.find_voice(sound_id)
+        if voice is None:
+            return
+
+        self.last_played[sound_id] = now
+        voice.sound_id = sound_id
+        voice.started = now
+        voice.channel.play(self.get(sound_id), loops)
 
     def fade(self, sound_id, time):
-        self.sounds[sound_id].fade(time)
+        self.get(sound_id).fade(time)
 
     def stop(self, sound_id):
-        self.sounds[sound_id].stop()
+        self.get(sound_id).stop()
+
+
+class MusicTrack:
+    """one music track, streamed off disk a chunk at a time
+
+    the next chunk is decoded once the last one starts playing and queued
+    up behind it on the track's own channel, so only about a second of it
+    is ever in memory.  while the track's volume is zero nothing's decoded
+    at all, it just keeps time, so it comes back in where it would've been.
+    a track in a different format than the mixer can't be queued up raw
+    like that, so it's loaded whole as a Sound instead, which pygame
+    resamples, and left looping on the channel"""
+    CHUNK_SECONDS = 0.5
+
+    def __init__(self, path, channel_id):
+        self.path = path
+        self.channel = pygame.mixer.Channel(channel_id)
+        self.wave = None
+        self.sound = None   # the whole track, if it can't be streamed
+        self.volume = 0.0
+        self.started = 0.0   # when the track started, to keep time by
+        self.next_frame = 0   # the first frame of the next chunk to queue
+
+    def set_volume(self, volume):
+        self.volume = volume
+        self.channel.set_volume(volume)
+
+    def play(self, volume):
+        """starts the track from the top"""
+        if self.wave is None and self.sound is None:
+            self.wave = wave.open(assets.open(self.path))
+            frequency, size, channels = pygame.mixer.get_init()
+            if (self.wave.getframerate(), self.wave.getsampwidth() * 8, self.wave.getnchannels()) \
+                    != (frequency, abs(size), channels):
+                self.wave = None
+                self.sound = pygame.mixer.Sound(assets.open(self.path))
+            else:
+                self.length = self.wave.getnframes()
+                self.chunk_frames = int(self.wave.getframerate() * self.CHUNK_SECONDS)
+
+        self.channel.stop()
+        self.volume = volume
+        self.started = time.perf_counter()
+        self.next_frame = 0
+        if self.sound is not None:
+            self.channel.play(self.sound, -1)
+            self.channel.set_volume(volume)
+
+    def chunk(self):
+        """decodes the next chunk, wrapping around to the top to loop"""
+        self.wave.setpos(self.next_frame)
+        data = self.wave.readframes(self.chunk_frames)
+        if self.next_frame + self.chunk_frames > self.length:
+            self.wave.rewind()
+            data += self.wave.readframes(self.next_frame + self.chunk_frames - self.length)
+
+        self.next_frame = (self.next_frame + self.chunk_frames) % self.length
+        return pygame.mixer.Sound(buffer=data)
+
+    def feed(self):
+        """keeps a chunk queued up behind the one playing"""
+        if self.wave is None:
+            return
+
+        if self.volume <= 0:
+            if self.channel.get_busy():
+                self.channel.stop()
+            return
+
+        if not self.channel.get_busy():
+            # coming back in, so catch up to where the track would be by now
+            elapsed = time.perf_counter() - self.started
+            self.next_frame = int(elapsed * self.wave.getframerate()) % self.length
+            self.channel.play(self.chunk())
+            self.channel.set_volume(self.volume)
+
+        if self.channel.get_queue() is None:
+            self.channel.queue(self.chunk())
+
+
+class Music:
+    """the music tracks, which all play at once and get mixed by volume
+
+    each track gets a channel of its own, reserved so sound effects never
+    take it over.  fades are scheduled once, as a start time, a length and
+    the volumes to go between, and each frame only moves the ones still
+    going along to wherever the clock says they should be.  with nothing
+    fading there's nothing to do but keep the tracks fed"""
+    FADE_TIME = 40 / FPS   # seconds to fade all the way from one track to another
 
-    def play_music(self, sound_id, fade_in=0):
-        self.music_id = sound_id
-        self.sounds[sound_id].play(-1, 0, fade_in)
+    def __init__(self):
+        self.tracks = []
+        self.playing = False
+        self.fades = {}   # track_id: (start, length, start_volume, end_volume)
 
-    def fade_music(self, time):
-        self.sounds[self.music_id].fadeout(time)
+    def add(self, file_path):
+        track_id = len(self.tracks)
+        self.tracks.append(MusicTrack(os.path.join("sounds", file_path), track_id))
+        pygame.mixer.set_reserved(len(self.tracks))
+
+    def play(self, track_id):
+        """starts every track together, with only one of them turned up"""
+        for other_id, track in enumerate(self.tracks):
+            track.play(1.0 if other_id == track_id else 0.0)
+        self.fades.clear()
+        self.playing = True
+
+    def fade_to(self, track_id):
+        """fades one track up and the rest down, from wherever they are now"""
+        now = time.perf_counter()
+        for other_id, track in enumerate(self.tracks):
+            volume = 1.0 if other_id == track_id else 0.0
+            if track.volume == volume:
+                self.fades.pop(other_id, None)
+            else:
+                length = self.FADE_TIME * abs(volume - track.volume)
+                self.fades[other_id] = (now, length, track.volume, volume)
+
+    def automate(self, now):
+        """sets every fading track to the volume it should be at by now"""
+        for track_id, (start, length, start_volume, end_volume) in list(self.fades.items()):
+            progress = (now - start) / length
+            if progress >= 1:
+                del self.fades[track_id]
+                self.tracks[track_id].set_volume(end_volume)
+            else:
+                self.tracks[track_id].set_volume(start_volume + (end_volume - start_volume) * progress)
 
-    def change_music(self, sound_id, fade_in=0):
-        """fades one music track into another"""
-        self.fade_music(fade_in)
-        self.play_music(sound_id, fade_in)
+    def feed(self):
+        if self.fades:
+            self.automate(time.perf_counter())
 
-    def update(self):
-        shop = self.sounds[MUSIC_SHOP]
-        shop_volume = shop.get_volume()
-        underworld = self.sounds[MUSIC_UNDERWORLD]
-        underworld_volume = underworld.get_volume()
-        if shop_volume < 1.0 and player.inShop:
-            shop.set_volume(shop_volume + 0.025)
-            underworld.set_volume(1 - shop_volume)
-        elif underworld_volume < 1.0 and not player.inShop:
-            underworld.set_volume(underworld_volume + 0.025)
-            shop.set_volume(1 - underworld_volume)
+        for track in self.tracks:
+            track.feed()
 
 
 class Camera:
@@ -478,6 +1388,21 @@ class Camera:
         y = position[1] + -(self.body.y - int(SCRN_H / 2))
         return int(x), int(y)
 
+    def world_pos(self, position):
+        """returns where a point on the screen is in the map, the opposite of pos()"""
+        x = position[0] + self.body.x - int(SCRN_W / 2)
+        y = position[1] + self.body.y - int(SCRN_H / 2)
+        return x, y
+
+    def view(self, position):
+        """returns the x and y based on where the camera is drawn this frame
+
+        use this for drawing and pos() for game logic"""
+        camera_x, camera_y = self.body.lerp_pos()
+        x = position[0] + -(camera_x - int(SCRN_W / 2))
+        y = position[1] + -(camera_y - int(SCRN_H / 2))
+        return int(x), int(y)
+
     def handle(self):
         if not player.inShop:
             self.focus()
@@ -485,16 +1410,207 @@ class Camera:
             self.step_to(SHOP_CENTER[0], SHOP_CENTER[1])
 
 
+class Level:
+    """a level, described by a json file in the levels folder
+
+    the tiles come from a template image in the images folder, with a
+    colour for each kind of wall, and the json can add walls on top as
+    rectangles of tiles, sorted by who they block.  it also has the shop,
+    where enemies spawn and where things go.  the first load packs the
+    finished tiles and the rest of it into a .lvl file next to the json,
+    and after that loading is just reading that file back, until the json
+    or the template changes and the hash doesn't match anymore"""
+    FOLDER = "levels"
+    MAGIC = b"LVL"
+    VERSION = 1
+    HEADER = struct.Struct("<3sB20sHHI")   # magic, version, sha1, width, height, info size
+    SOLID_TO = {"all": ALL_WALL, "player": PLAYER_WALL, "enemy": ENEMY_WALL,
+                "nothing": EMPTY, "void": VOID}
+
+    def __init__(self, width, height, tiles, info):
+        self.width = width
+        self.height = height
+        self.tiles = tiles   # row by row with a VOID border, like Grid.tiles
+        self.background = info["background"]
+        self.shop = info["shop"]   # col, row, width and height in tiles
+        self.spawns = info["spawns"]
+        self.props = info["props"]
+
+    @classmethod
+    def load(cls, name):
+        source_path = os.path.join(cls.FOLDER, name + ".json")
+        packed_path = os.path.join(cls.FOLDER, name + ".lvl")
+        source = assets.read(source_path)
+        digest = hashlib.sha1(source)
+        source = json.loads(bytes(source))
+        if "template" in source:
+            digest.update(assets.read(os.path.join("images", source["template"]["image"])))
+        digest = digest.digest()
+
+        try:
+            with open(packed_path, "rb") as file:
+                level = cls.unpack(file.read(), digest)
+        except OSError:
+            level = None
+
+        if level is None:
+            level, packed = cls.compile(source, digest)
+            try:
+                with open(packed_path, "wb") as file:
+                    file.write(packed)
+            except OSError:
+                pass   # it only saves time, the level's fine without it
+
+        return level
+
+    @classmethod
+    def compile(cls, source, digest):
+        """builds the tiles from the json and packs them, returning both"""
+        if "template" in source:
+            width, height, inside = cls.read_template(**source["template"])
+        else:
+            width, height = source["size"]
+            inside = bytes([EMPTY]) * (width * height)
+
+        stride = width + 2
+        tiles = bytearray([VOID]) * (stride * (height + 2))
+        for row in range(height):
+            start = (row + 1) * stride + 1
+            tiles[start:start + width] = inside[row * width:(row + 1) * width]
+
+        for walls in source.get("walls", ()):
+            kind = bytes([cls.SOLID_TO[walls["solid_to"]]])
+            for col, row, w, h in walls["rects"]:
+                if col < 0 or row < 0 or col + w > width or row + h > height:
+                    print("Level.compile() skipped a rect out of bounds.", walls.get("note", ""))
+                    continue
+
+                for y in range(row, row + h):
+                    start = (y + 1) * stride + col + 1
+                    tiles[start:start + w] = kind * w
+
+        info = {key: source[key] for key in ("background", "shop", "spawns", "props")}
+        packed_info = json.dumps(info, separators=(",", ":")).encode()
+        header = cls.HEADER.pack(cls.MAGIC, cls.VERSION, digest, width, height, len(packed_info))
+        return cls(width, height, tiles, info), header + tiles + packed_info
+
+    @classmethod
+    def read_template(cls, image, tile_size, colours):
+        """returns the width, height and tile kinds painted in a template image
+
+        each tile goes by the pixel in its middle.  colours maps hex colours
+        to who the tile is solid to, and any other colour is floor, so walls
+        can be painted right over a copy of the level art"""
+        surf = pygame.image.load(assets.open(os.path.join("images", image)), image)
+        pixel_w, pixel_h = surf.get_size()
+        width = pixel_w // tile_size
+        height = pixel_h // tile_size
+        middle = tile_size // 2
+        pixels = pygame.image.tobytes(surf, "RGB")
+        kinds = {int(colour, 16): cls.SOLID_TO[solid_to] for colour, solid_to in colours.items()}
+
+        if numpy is not None:
+            middles = numpy.frombuffer(pixels, numpy.uint8).reshape(pixel_h, pixel_w, 3)
+            middles = middles[middle::tile_size, middle::tile_size][:height, :width]
+            middles = middles.astype(numpy.uint32)
+            keys = middles[..., 0] << 16 | middles[..., 1] << 8 | middles[..., 2]
+            tiles = numpy.full((height, width), EMPTY, numpy.uint8)
+            for key, kind in kinds.items():
+                tiles[keys == key] = kind
+
+            return width, height, tiles.tobytes()
+
+        tiles = bytearray()
+        for row in range(height):
+            start = (row * tile_size + middle) * pixel_w * 3
+            for col in range(width):
+                i = start + (col * tile_size + middle) * 3
+                tiles.append(kinds.get(pixels[i] << 16 | pixels[i + 1] << 8 | pixels[i + 2], EMPTY))
+
+        return width, height, bytes(tiles)
+
+    @classmethod
+    def unpack(cls, packed, digest):
+        """reads a packed level back, or returns None if it's stale or broken"""
+        try:
+            magic, version, packed_digest, width, height, info_size = cls.HEADER.unpack_from(packed)
+        except struct.error:
+            return None
+
+        if magic != cls.MAGIC or version != cls.VERSION or packed_digest != digest:
+            return None
+
+        tiles_end = cls.HEADER.size + (width + 2) * (height + 2)
+        if len(packed) != tiles_end + info_size:
+            return None
+
+        tiles = bytearray(packed[cls.HEADER.size:tiles_end])
+        try:
+            return cls(width, height, tiles, json.loads(packed[tiles_end:]))
+        except (ValueError, KeyError, TypeError):   # UnicodeDecodeError is a ValueError too
+            return None
+
+    def spawn_point(self):
+        """picks a random spot from a random spawn line"""
+        roll = rng.random()
+        for spawn in self.spawns:
+            roll -= spawn["chance"]
+            if roll < 0:
+                break
+
+        lines = spawn["lines"]
+        x1, y1, x2, y2 = lines[0] if len(lines) == 1 else rng.choice(lines)
+        x = x1 if x1 == x2 else rng.randint(x1, x2)
+        y = y1 if y1 == y2 else rng.randint(y1, y2)
+        return x, y
+
+
 class Grid:
-    """the grid where all the tiles in the level are placed"""
-    def __init__(self, width, height):
+    """the grid where all the tiles in the level are placed
+
+    tiles are kept row by row in one bytearray, with a border of VOID tiles
+    all the way around.  for each requester there's a layer saying which
+    tiles are solid to it, plus a bitmask of the solid tiles in every row
+    and column, so checking a whole span of tiles is a single lookup"""
+    SOLID_TO = {ALL: (ALL_WALL, PLAYER_WALL, ENEMY_WALL),
+                PLAYER: (ALL_WALL, PLAYER_WALL),
+                ENEMY: (ALL_WALL, ENEMY_WALL)}
+    BITS = bytes.maketrans(b"\x00\x01", b"01")
+
+    def __init__(self, width, height, tiles=None):
         self.GRID_W = width
         self.GRID_H = height
         self.FULL_W = width * TILE_W
         self.FULL_H = height * TILE_H
-        self.grid = [[EMPTY for _ in range(height)] for _ in range(width)]
         self.surf = None
 
+        self.stride = width + 2
+        self.version = 0   # goes up whenever a tile changes
+        self.solid = {}
+        self.row_masks = {}
+        self.col_masks = {}
+        if tiles is None:
+            tiles = bytearray([VOID]) * (self.stride * (height + 2))
+            for row in range(height):
+                start = (row + 1) * self.stride + 1
+                tiles[start:start + width] = bytes([EMPTY]) * width
+
+        self.load_tiles(tiles)
+
+    def load_tiles(self, tiles):
+        """swaps in every tile at once, border included, and redoes the layers"""
+        self.tiles = bytearray(tiles)
+        self.version += 1
+        stride = self.stride
+        for requester, solid_kinds in self.SOLID_TO.items():
+            layer = self.tiles.translate(bytes(kind in solid_kinds for kind in range(256)))
+            bits = layer.translate(self.BITS)   # a string of 0s and 1s to read masks from
+            self.solid[requester] = layer
+            self.row_masks[requester] = [int(bits[start:start + stride][::-1], 2)
+                                         for start in range(0, len(bits), stride)]
+            self.col_masks[requester] = [int(bits[col::stride][::-1], 2)
+                                         for col in range(stride)]
+
     def out_of_bounds(self, col, row):
         """returns whether or not a tile is outside of the grid"""
         if 0 <= col < self.GRID_W and 0 <= row < self.GRID_H:
@@ -502,10 +1618,27 @@ class Grid:
 
         return True
 
+    def set_tile(self, col, row, kind):
+        """changes one tile and its spot in every solidity layer"""
+        i = (row + 1) * self.stride + col + 1
+        self.tiles[i] = kind
+        self.version += 1
+        for requester, solid_kinds in self.SOLID_TO.items():
+            col_bit = 1 << (col + 1)
+            row_bit = 1 << (row + 1)
+            if kind in solid_kinds:
+                self.solid[requester][i] = 1
+                self.row_masks[requester][row + 1] |= col_bit
+                self.col_masks[requester][col + 1] |= row_bit
+            else:
+                self.solid[requester][i] = 0
+                self.row_masks[requester][row + 1] &= ~col_bit
+                self.col_masks[requester][col + 1] &= ~row_bit
+
     def change_point(self, col, row, kind):
         """changes a rectangle"""
         if not self.out_of_bounds(col, row):
-            self.grid[col][row] = kind
+            self.set_tile(col, row, kind)
         else:
             print("change_point() tried to add a tile out of bounds.")
 
@@ -514,7 +1647,7 @@ class Grid:
         for col in range(x, x + w):
             for row in range(y, y + h):
                 if not self.out_of_bounds(col, row):
-                    self.grid[col][row] = kind
+                    self.set_tile(col, row, kind)
                 else:
                     print("change_rect() tried to add a tile out of bounds.")
 
@@ -523,7 +1656,7 @@ class Grid:
 
         all tiles out of bounds return VOID"""
         if not self.out_of_bounds(col, row):
-            return self.grid[col][row]
+            return self.tiles[(row + 1) * self.stride + col + 1]
 
         return VOID
 
@@ -531,53 +1664,410 @@ class Grid:
         """returns whether a tile is solid or not
 
         you can specify which entity specifically is asking for it"""
-        tile = self.tile_at(col, row)
-        if tile == ALL_WALL:
-            return True
-        elif (requester == PLAYER or requester == ALL) and tile == PLAYER_WALL:
-            return True
-        elif (requester == ENEMY or requester == ALL) and tile == ENEMY_WALL:
-            return True
+        if -1 <= col <= self.GRID_W and -1 <= row <= self.GRID_H:
+            return self.solid[requester][(row + 1) * self.stride + col + 1] == 1
 
-        return False
+        return False   # past the border is all VOID
 
-    def collide_vert(self, x, y1, y2, requester=ALL):
-        col = col_at(x)
-        start_row = row_at(y1)
-        end_row = row_at(y2)
-        for row in range(start_row, end_row + 1):
-            if self.is_solid(col, row, requester):
-                return True
+    def solid_in_row(self, row, first_col, last_col, requester=ALL):
+        """returns whether any tile from first_col to last_col in a row is solid"""
+        if not -1 <= row <= self.GRID_H:
+            return False
 
-        return False
+        first = first_col + 1 if first_col > -1 else 0   # clamped to the border
+        last = last_col + 2 if last_col < self.GRID_W else self.GRID_W + 2
+        if last <= first:
+            return False
 
-    def collide_horiz(self, x1, x2, y, requester=ALL):
-        start_col = col_at(x1)
-        end_col = col_at(x2)
-        row = row_at(y)
-        for col in range(start_col, end_col + 1):
-            if self.is_solid(col, row, requester):
-                return True
+        return self.row_masks[requester][row + 1] & ((1 << last) - (1 << first)) > 0
 
-        return False
+    def solid_in_col(self, col, first_row, last_row, requester=ALL):
+        """returns whether any tile from first_row to last_row in a column is solid"""
+        if not -1 <= col <= self.GRID_W:
+            return False
+
+        first = first_row + 1 if first_row > -1 else 0
+        last = last_row + 2 if last_row < self.GRID_H else self.GRID_H + 2
+        if last <= first:
+            return False
+
+        return self.col_masks[requester][col + 1] & ((1 << last) - (1 << first)) > 0
+
+    def collide_vert(self, x, y1, y2, requester=ALL):
+        return self.solid_in_col(col_at(x), row_at(y1), row_at(y2), requester)
+
+    def collide_horiz(self, x1, x2, y, requester=ALL):
+        return self.solid_in_row(row_at(y), col_at(x1), col_at(x2), requester)
 
     def create_surf(self):
         """draws the entire stage"""
         dimensions = (self.FULL_W + TILE_W * 2, self.FULL_H + TILE_H*2)
         self.surf = pygame.Surface(dimensions)
-        self.surf.blit(level_background, (0, 0))
+        self.surf.blit(level_background.result(), (0, 0))
 
     def draw(self, surf):
-        surf.blit(self.surf, camera.pos((-TILE_W, -TILE_H)))
+        if self.surf is None:
+            self.create_surf()
+        dirty.restore(surf, self.surf, camera.view((-TILE_W, -TILE_H)))
+
+
+class FlowField:
+    """which way to go from every tile to get to one target tile
+
+    it's a breadth first search out from the target through the tiles that
+    aren't solid to the requester, border included, and it's only redone
+    when the target moves into another tile or the grid changes.  each
+    tile points at the neighbour it was reached from, so anything can look
+    up which way to head from where it is without searching on its own"""
+    NEIGHBOURS = ((1, 0), (-1, 0), (0, 1), (0, -1),
+                  (1, 1), (-1, -1), (1, -1), (-1, 1))   # opposites in pairs
+    UNKNOWN = 0
+    CLEAR = 1
+    BLOCKED = 2
+
+    def __init__(self, grid, requester):
+        self.grid = grid
+        self.requester = requester
+        self.target = None
+        self.version = -1
+
+        stride = grid.stride
+        self.offsets = [dy * stride + dx for dx, dy in self.NEIGHBOURS]
+        self.vectors = [(dx / math.hypot(dx, dy), dy / math.hypot(dx, dy))
+                        for dx, dy in self.NEIGHBOURS]
+        self.distances = array("l", [-1]) * len(grid.tiles)
+        self.ways = bytearray(len(grid.tiles))   # index into vectors, plus one
+        self.sight = bytearray(len(grid.tiles))   # whether the target can be seen
+
+    def aim(self, pos):
+        """points the field at the tile a position is in, rebuilding if needed"""
+        target = (col_at(pos[0]), row_at(pos[1]))
+        if target != self.target or self.grid.version != self.version:
+            self.build(target)
+
+    def build(self, target):
+        grid = self.grid
+        stride = grid.stride
+        size = len(grid.tiles)
+        solid = grid.solid[self.requester]
+        offsets = self.offsets
+        self.target = target
+        self.version = grid.version
+        self.distances = distances = array("l", [-1]) * size
+        self.ways = ways = bytearray(size)
+        self.sight = bytearray(size)
+
+        col, row = target
+        if not (-1 <= col <= grid.GRID_W and -1 <= row <= grid.GRID_H):
+            return   # nothing can find its way out there
+
+        start = (row + 1) * stride + col + 1
+        distances[start] = 0
+        frontier = collections.deque((start,))
+        while frontier:
+            i = frontier.popleft()
+            i_col = i % stride
+            next_distance = distances[i] + 1
+            for way, (dx, dy) in enumerate(self.NEIGHBOURS):
+                if not 0 <= i_col + dx < stride:
+                    continue
+
+                n = i + offsets[way]
+                if not 0 <= n < size or distances[n] != -1 or solid[n]:
+                    continue
+
+                if dx and dy and (solid[i + dx] or solid[i + dy * stride]):
+                    continue   # no cutting corners
+
+                distances[n] = next_distance
+                ways[n] = (way ^ 1) + 1   # the opposite way, back towards i
+                frontier.append(n)
+
+    def can_see(self, i, col, row):
+        """returns whether a straight line from a tile to the target is clear
+
+        worked out the first time anything asks and kept until the next build"""
+        seen = self.sight[i]
+        if seen == self.UNKNOWN:
+            seen = self.CLEAR
+            target_col, target_row = self.target
+            steps = max(abs(target_col - col), abs(target_row - row)) * 2
+            for step in range(1, steps):
+                check_col = math.floor(col + 0.5 + (target_col - col) * step / steps)
+                check_row = math.floor(row + 0.5 + (target_row - row) * step / steps)
+                if self.grid.is_solid(check_col, check_row, self.requester):
+                    seen = self.BLOCKED
+                    break
+
+            self.sight[i] = seen
+
+        return seen == self.CLEAR
+
+    def steer(self, pos):
+        """returns which way to head from a position to go around walls
+
+        gives None if there's nothing in the way and you can head straight
+        for the target, or if there's no way there at all"""
+        grid = self.grid
+        col = col_at(pos[0])
+        row = row_at(pos[1])
+        if not (-1 <= col <= grid.GRID_W and -1 <= row <= grid.GRID_H):
+            return None
+
+        i = (row + 1) * grid.stride + col + 1
+        if self.distances[i] <= 0 or self.can_see(i, col, row):
+            return None
+
+        return self.vectors[self.ways[i] - 1]
 
 
 def collide(rect1, rect2):
-    return pygame.Rect(rect1).colliderect(rect2)
+    return rect1.colliderect(rect2)
+
+
+class SpatialHash:
+    """sorts things with a body into tile sized cells by where their hitbox is
+
+    a thing is kept in every cell its hitbox touches, and its body moves it
+    between cells whenever it moves, so asking what's near a spot only looks
+    at the things in the cells around it"""
+    def __init__(self, cell_w=TILE_W, cell_h=TILE_H):
+        self.cell_w = cell_w
+        self.cell_h = cell_h
+        self.cells = {}   # (col, row): {thing: None}, a dict so the order stays put
+
+    def cell_range(self, body):
+        """returns the first and last column and row the body's hitbox touches"""
+        left = body.x - body.extend_x
+        top = body.y - body.extend_y
+        return (int(left // self.cell_w),
+                int(top // self.cell_h),
+                int((left + body.w + body.extend_x*2 - 1) // self.cell_w),
+                int((top + body.h + body.extend_y*2 - 1) // self.cell_h))
+
+    def insert(self, thing, cells):
+        first_col, first_row, last_col, last_row = cells
+        for col in range(first_col, last_col + 1):
+            for row in range(first_row, last_row + 1):
+                cell = self.cells.get((col, row))
+                if cell is None:
+                    cell = self.cells[(col, row)] = {}
+                cell[thing] = None
+
+    def erase(self, thing, cells):
+        first_col, first_row, last_col, last_row = cells
+        for col in range(first_col, last_col + 1):
+            for row in range(first_row, last_row + 1):
+                cell = self.cells[(col, row)]
+                del cell[thing]
+                if not cell:
+                    del self.cells[(col, row)]
+
+    def add(self, thing):
+        body = thing.body
+        body.space = self
+        body.owner = thing
+        body.cells = self.cell_range(body)
+        self.insert(thing, body.cells)
+
+    def remove(self, thing):
+        body = thing.body
+        self.erase(thing, body.cells)
+        body.space = None
+        body.owner = None
+
+    def update(self, body):
+        """moves a body's thing into the cells it touches now"""
+        cells = self.cell_range(body)
+        if cells != body.cells:
+            self.erase(body.owner, body.cells)
+            self.insert(body.owner, cells)
+            body.cells = cells
+
+    def near(self, first_col, first_row, last_col, last_row):
+        """returns everything in a block of cells, each only once"""
+        found = {}
+        for col in range(first_col, last_col + 1):
+            for row in range(first_row, last_row + 1):
+                cell = self.cells.get((col, row))
+                if cell:
+                    found.update(cell)
+
+        return found
+
+    def overlapping(self, rect):
+        """returns the things whose hitbox overlaps rect"""
+        found = self.near(int(rect.left // self.cell_w), int(rect.top // self.cell_h),
+                          int((rect.right - 1) // self.cell_w),
+                          int((rect.bottom - 1) // self.cell_h))
+        return [thing for thing in found if thing.body.hitbox.colliderect(rect)]
+
+    def closest_in_range(self, point, center, radius):
+        """returns the thing closest to point out of those within radius of center
+
+        distances are compared squared and the cells are walked in place, so
+        it doesn't make anything new"""
+        center_x, center_y = center
+        point_x, point_y = point
+        radius_squared = radius * radius
+
+        best = None
+        best_dist = 0
+        for col in range(int((center_x - radius) // self.cell_w),
+                         int((center_x + radius) // self.cell_w) + 1):
+            for row in range(int((center_y - radius) // self.cell_h),
+                             int((center_y + radius) // self.cell_h) + 1):
+                cell = self.cells.get((col, row))
+                if not cell:
+                    continue
+
+                for thing in cell:
+                    x, y = thing.body.pos_center()
+                    if (x - center_x) ** 2 + (y - center_y) ** 2 >= radius_squared:
+                        continue
+
+                    dist = (x - point_x) ** 2 + (y - point_y) ** 2
+                    if best is None or dist < best_dist:
+                        best = thing
+                        best_dist = dist
+
+        return best
+
+    def nearest(self, pos, accept=None):
+        """returns the thing whose center is closest to pos, or None
+
+        accept can be a function that says which things count.  cells are
+        searched in growing rings around pos, stopping once nothing further
+        out could be closer, or once the rings cover the whole grid"""
+        if not self.cells:
+            return None
+
+        col = int(pos[0] // self.cell_w)
+        row = int(pos[1] // self.cell_h)
+        last_col = (grid.GRID_W * TILE_W - 1) // self.cell_w
+        last_row = (grid.GRID_H * TILE_H - 1) // self.cell_h
+        reach = max(col, last_col - col, row, last_row - row) + 1   # + 1 for the border
+
+        best = None
+        best_dist = 0
+        for ring in range(reach + 1):
+            if best is not None and best_dist <= (ring - 1) * min(self.cell_w, self.cell_h):
+                break
+
+            for key in self.ring(col, row, ring):
+                for thing in self.cells.get(key, ()):
+                    if accept is None or accept(thing):
+                        dist = distance(pos, thing.body.pos_center())
+                        if best is None or dist < best_dist:
+                            best = thing
+                            best_dist = dist
+
+        return best
+
+    @staticmethod
+    def ring(col, row, ring):
+        """returns the cells exactly ring cells away from a cell"""
+        if ring == 0:
+            return [(col, row)]
+
+        cells = []
+        for x in range(col - ring, col + ring + 1):
+            cells.append((x, row - ring))
+            cells.append((x, row + ring))
+        for y in range(row - ring + 1, row + ring):
+            cells.append((col - ring, y))
+            cells.append((col + ring, y))
+
+        return cells
+
+
+class GlyphAtlas:
+    """every printable character of a font in one color, rendered once
+
+    strings are pieced together out of the cached glyphs instead of making
+    the font rasterise them again"""
+    FIRST_CHAR = 32
+    LAST_CHAR = 126
+    CACHE_SIZE = 32
+
+    def __init__(self, font, color):
+        self.font = font
+        self.color = color
+        self.h = font.get_height()
+        if color == GREEN:
+            self.colorkey = BLACK
+        else:
+            self.colorkey = GREEN
+
+        chars = [chr(i) for i in range(self.FIRST_CHAR, self.LAST_CHAR + 1)]
+        full_w = sum(font.size(char)[0] for char in chars)
+        self.surf = pygame.Surface((full_w, self.h))
+        self.surf.fill(self.colorkey)
+
+        self.glyphs = {}   # char: (surface, area)
+        x = 0
+        for char in chars:
+            glyph = font.render(char, False, color)
+            self.surf.blit(glyph, (x, 0))
+            self.glyphs[char] = (self.surf, pygame.Rect(x, 0, glyph.get_width(), self.h))
+            x += glyph.get_width()
+
+        self.strings = collections.OrderedDict()
 
+    def glyph(self, char):
+        """returns the surface and area of a character
 
-# CELL_W = 10
-# CELL_H = 10
-# partition = [[[] for y in range(CELL_H)] for x in range(CELL_W)]
+        characters outside of the atlas get rendered once on first use"""
+        if char not in self.glyphs:
+            glyph = self.font.render(char, False, self.color)
+            self.glyphs[char] = (glyph, glyph.get_rect())
+
+        return self.glyphs[char]
+
+    def width(self, string):
+        return sum(self.glyph(char)[1].w for char in string)
+
+    def blank(self, width):
+        """returns an empty surface for glyphs to be drawn onto"""
+        surf = pygame.Surface((width, self.h))
+        surf.fill(self.colorkey)
+        surf.set_colorkey(self.colorkey)
+        return surf
+
+    def draw_glyph(self, surf, char, x):
+        """draws one character onto a surface, returns the x after it"""
+        glyph, area = self.glyph(char)
+        surf.blit(glyph, (x, 0), area)
+        return x + area.w
+
+    def render(self, string):
+        """returns a surface of the whole string, reusing recent ones"""
+        if string in self.strings:
+            self.strings.move_to_end(string)
+            return self.strings[string]
+
+        surf = self.blank(self.width(string))
+        x = 0
+        for char in string:
+            x = self.draw_glyph(surf, char, x)
+
+        self.strings[string] = surf
+        if len(self.strings) > self.CACHE_SIZE:
+            self.strings.popitem(last=False)
+
+        return surf
+
+
+glyph_atlases = {}
+
+
+def get_glyphs(font, color):
+    """returns the glyph atlas of a font in a color, building it if needed"""
+    key = (font, color)
+    if key not in glyph_atlases:
+        glyph_atlases[key] = GlyphAtlas(font, color)
+
+    return glyph_atlases[key]
 
 
 class Score:
@@ -594,8 +2084,8 @@ class Score:
         self.y = pos[1]
 
     def draw(self, surf):
-        text = FONT.render(str(self.count), False, self.color)
-        surf.blit(text, (self.x, self.y))
+        text = get_glyphs(FONT, self.color).render(str(self.count))
+        dirty.blit(surf, text, (self.x, self.y))
 
     def change(self, amount):
         self.timer = self.COLOR_CHANGE_TIME
@@ -612,8 +2102,6 @@ class Score:
         else:
             self.color = WHITE
 
-        self.draw(postSurf)
-
 
 class Text:
     SCROLL_FRAME = 2
@@ -622,7 +2110,7 @@ class Text:
         self.x = pos[0]
         self.y = pos[1]
         self.string = text
-        self.width = FONT.render(text, False, WHITE).get_width()
+        self.width = FONT.size(text)[0]
         self.letters = len(text)
 
         self.scroll_delay = 0
@@ -637,18 +2125,37 @@ class Text:
             self.completion = self.letters
 
         self.ui = ui
+        self.lines = {}   # color: [surface, letters drawn, next glyph x]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["lines"] = {}   # they're drawn again from the start
+        return state
+
+    def line(self, color):
+        """returns the surface of the text so far, adding any new letters"""
+        glyphs = get_glyphs(FONT_SMALL, color)
+        if color not in self.lines:
+            self.lines[color] = [glyphs.blank(glyphs.width(self.string)), 0, 0]
+
+        line = self.lines[color]
+        while line[1] < self.completion:
+            line[2] = glyphs.draw_glyph(line[0], self.string[line[1]], line[2])
+            line[1] += 1
+
+        return line[0]
 
     def render(self, king_text=False):
         if self.ui:
             position = (self.x, self.y)
         else:
-            position = camera.pos((self.x, self.y))
+            position = camera.view((self.x, self.y))
 
         if king_text:
-            text = FONT_SMALL.render(self.string[: self.completion], False, BLACK)
+            text = self.line(BLACK)
         else:
-            text = FONT_SMALL.render(self.string[: self.completion], False, WHITE)
-        postSurf.blit(text, position)
+            text = self.line(WHITE)
+        dirty.blit(postSurf, text, position)
 
     def scroll(self):
         if self.scrolling:
@@ -677,12 +2184,14 @@ class TextHandler:
         self.text_count -= 1
         del self.texts[i]
 
-    def update(self, king_text=False):
-        i = self.text_count
+    def draw(self, king_text=False):
         for text in reversed(self.texts):
-            i -= 1
             text.render(king_text)
 
+    def update(self):
+        i = self.text_count
+        for text in reversed(self.texts):
+            i -= 1
             if text.scrolling:
                 if text.completion < text.letters:
                     text.scroll()
@@ -693,69 +2202,272 @@ class TextHandler:
                         self.delete(i)
 
 
+class BodyStore:
+    """the positions and velocities of every body, kept in columns
+
+    each body is a view onto one slot of the columns, so a whole group of
+    them can be moved at once with integrate().  numpy does that in bulk
+    when it's installed, otherwise it's a loop over the columns.
+    VECTOR_MIN is the smallest group worth handing to numpy"""
+    FLOATS = ("x", "y", "xVel", "yVel", "xAcc", "yAcc", "last_x", "last_y")
+    FLAGS = ("xDir", "yDir", "moving")
+    VECTOR_MIN = 16
+
+    def __init__(self):
+        self.columns = {}
+        for name in self.FLOATS:
+            self.columns[name] = array("d")
+        for name in self.FLAGS:
+            self.columns[name] = array("b")
+        self.columns["last_tick"] = array("q")
+
+        for name, column in self.columns.items():
+            setattr(self, name, column)
+
+        self.free = []   # slots of bodies that are gone
+
+    def add(self, x, y):
+        """gives a new body a slot, standing still at x, y"""
+        if self.free:
+            slot = self.free.pop()
+            self.reset(slot, x, y)
+        else:
+            slot = len(self.x)
+            for column, value in zip(self.columns.values(), (x, y, 0, 0, 0, 0, x, y, 0, 0, 0, -1)):
+                column.append(value)
+
+        return slot
+
+    def reset(self, slot, x, y):
+        """stands the body in a slot still at x, y"""
+        for column, value in zip(self.columns.values(), (x, y, 0, 0, 0, 0, x, y, 0, 0, 0, -1)):
+            column[slot] = value
+
+    def release(self, slot):
+        self.free.append(slot)
+
+    def snapshot(self):
+        return {name: column.tobytes() for name, column in self.columns.items()}, list(self.free)
+
+    def restore(self, snapshot):
+        """loads a snapshot back into the same columns, which bodies read straight from"""
+        columns, free = snapshot
+        for name, data in columns.items():
+            column = self.columns[name]
+            del column[:]
+            column.frombytes(data)
+        self.free = free
+
+    def vectors(self, group, names):
+        """returns the slots of group and numpy views of the named columns"""
+        slots = numpy.fromiter([body.slot for body in group], numpy.intp, len(group))
+        views = []
+        for name in names:
+            column = self.columns[name]
+            kind = {"d": numpy.float64, "b": numpy.int8, "q": numpy.int64}[column.typecode]
+            views.append(numpy.frombuffer(column, kind))
+
+        return slots, views
+
+    def move(self, slot):
+        """moves the body in a slot based on its velocity and acceleration"""
+        if self.last_tick[slot] != timestep.tick:   # remember()
+            self.last_tick[slot] = timestep.tick
+            self.last_x[slot] = self.x[slot]
+            self.last_y[slot] = self.y[slot]
+
+        x_vel = self.xVel[slot] + self.xAcc[slot]
+        y_vel = self.yVel[slot] + self.yAcc[slot]
+        self.xVel[slot] = x_vel
+        self.yVel[slot] = y_vel
+        self.x[slot] += x_vel
+        self.y[slot] += y_vel
+
+        if x_vel < 0:
+            self.xDir[slot] = LEFT
+        elif x_vel > 0:
+            self.xDir[slot] = RIGHT
+        else:
+            self.xDir[slot] = 0
+
+        if y_vel < 0:
+            self.yDir[slot] = UP
+        elif y_vel > 0:
+            self.yDir[slot] = DOWN
+        else:
+            self.yDir[slot] = 0
+
+        self.moving[slot] = x_vel != 0 or y_vel != 0
+
+    def integrate(self, group):
+        """moves every body in group by one tick, same as calling move() on each
+
+        bodies in a spatial hash get moved between its cells afterwards"""
+        if numpy is None or len(group) < self.VECTOR_MIN:
+            for body in group:
+                body.move()
+            return
+
+        slots, (x, y, x_vel, y_vel, x_acc, y_acc, last_x, last_y,
+                x_dir, y_dir, moving, last_tick) = self.vectors(group, self.columns)
+
+        fresh = slots[last_tick[slots] != timestep.tick]   # remember()
+        last_tick[fresh] = timestep.tick
+        last_x[fresh] = x[fresh]
+        last_y[fresh] = y[fresh]
+
+        vel = x_vel[slots] + x_acc[slots]
+        x_vel[slots] = vel
+        x[slots] += vel
+        x_dir[slots] = numpy.where(vel < 0, LEFT, numpy.where(vel > 0, RIGHT, 0))
+
+        vel = y_vel[slots] + y_acc[slots]
+        y_vel[slots] = vel
+        y[slots] += vel
+        y_dir[slots] = numpy.where(vel < 0, UP, numpy.where(vel > 0, DOWN, 0))
+
+        moving[slots] = (x_dir[slots] != 0) | (y_dir[slots] != 0)
+
+        for body in group:
+            if body.space is not None:
+                body.space.update(body)
+
+    def next_positions(self, group):
+        """returns lists of where each body in group will be next tick"""
+        if numpy is None or len(group) < self.VECTOR_MIN:
+            next_x = []
+            next_y = []
+            for body in group:
+                slot = body.slot
+                next_x.append(self.x[slot] + self.xVel[slot] + self.xAcc[slot])
+                next_y.append(self.y[slot] + self.yVel[slot] + self.yAcc[slot])
+            return next_x, next_y
+
+        slots, (x, y, x_vel, y_vel, x_acc, y_acc) = self.vectors(group, self.FLOATS[:6])
+        return ((x[slots] + x_vel[slots] + x_acc[slots]).tolist(),
+                (y[slots] + y_vel[slots] + y_acc[slots]).tolist())
+
+    def damp(self, group, amount):
+        """divides the velocity of every body in group by amount"""
+        if numpy is None or len(group) < self.VECTOR_MIN:
+            for body in group:
+                slot = body.slot
+                self.xVel[slot] /= amount
+                self.yVel[slot] /= amount
+            return
+
+        slots, (x_vel, y_vel) = self.vectors(group, ("xVel", "yVel"))
+        x_vel[slots] = x_vel[slots] / amount
+        y_vel[slots] = y_vel[slots] / amount
+
+
+bodies = BodyStore()   # needed before Body, which reads straight from its columns
+
+
+def body_field(name):
+    """a Body attribute that lives in one of the store's columns"""
+    column = bodies.columns[name]
+
+    def get(self):
+        return column[self.slot]
+
+    def set(self, value):
+        column[self.slot] = value
+
+    return property(get, set)
+
+
 class Body:
     """the skeleton of anything that moves and lives
 
-    COLLISION_STEPS is the amount of substeps to check each step"""
-    COLLISION_STEPS = 4
+    the moving parts are kept in the body store, the body is a view of its slot"""
+
+    x = body_field("x")
+    y = body_field("y")
+    xVel = body_field("xVel")
+    yVel = body_field("yVel")
+    xAcc = body_field("xAcc")
+    yAcc = body_field("yAcc")
+    xDir = body_field("xDir")
+    yDir = body_field("yDir")
+    moving = body_field("moving")
+    last_x = body_field("last_x")   # position at the start of the last tick it moved
+    last_y = body_field("last_y")
+    last_tick = body_field("last_tick")
 
     def __init__(self, x, y, w, h, extend_x=0, extend_y=0):
-        self.x = x
-        self.y = y
-        self.xVel = 0
-        self.yVel = 0
-        self.xAcc = 0
-        self.yAcc = 0
+        self.slot = bodies.add(x, y)
+        self._gridbox = pygame.Rect(0, 0, 0, 0)
+        self._hitbox = pygame.Rect(0, 0, 0, 0)
 
-        self.xDir = 0
-        self.yDir = 0
+        self.grid = grid   # reference to the level layout
+
+        self.space = None   # the spatial hash it's in, if any
+        self.owner = None   # the thing it's the body of there
+        self.cells = None
+
+        self.reset(x, y, w, h, extend_x, extend_y)
+
+    def release(self):
+        """gives the body's slot back, once it's thrown away for good
+
+        pooled entities keep theirs while they wait to be reused"""
+        bodies.release(self.slot)
+        self.slot = None
+
+    def reset(self, x, y, w, h, extend_x=0, extend_y=0):
+        """makes the body like new, for when it's reused from a pool"""
+        bodies.reset(self.slot, x, y)
 
         self.w = w
         self.h = h
         self.extend_x = extend_x
         self.extend_y = extend_y
-        self.gridbox = pygame.Rect(x, y, w, h)
-        self.hitbox = pygame.Rect(x - extend_x, y - extend_y,
-                                  w + extend_x*2, h + extend_y*2)
-
-        self.moving = False
-        self.grid = grid   # reference to the level layout
+        self._gridbox.size = (w, h)
+        self._hitbox.size = (w + extend_x*2, h + extend_y*2)
+
+    @property
+    def gridbox(self):
+        """the body's rect, moved to where the body is now"""
+        self._gridbox.x = self.x
+        self._gridbox.y = self.y
+        return self._gridbox
+
+    @property
+    def hitbox(self):
+        """the rect it gets hit with, moved to where the body is now"""
+        self._hitbox.x = self.x - self.extend_x
+        self._hitbox.y = self.y - self.extend_y
+        return self._hitbox
+
+    def remember(self):
+        """keeps where the body was before it first moves in a tick"""
+        if self.last_tick != timestep.tick:
+            self.last_tick = timestep.tick
+            self.last_x = self.x
+            self.last_y = self.y
+
+    def lerp_pos(self):
+        """returns where to draw the body between the last two ticks"""
+        if self.last_tick != timestep.tick:
+            return self.x, self.y
+
+        t = 1 - timestep.alpha
+        return self.x - (self.x - self.last_x) * t, self.y - (self.y - self.last_y) * t
 
     def goto(self, x, y):
         """instantly moves the body to a specific position"""
+        self.remember()
         self.x = x
         self.y = y
-        self.gridbox.x = x
-        self.gridbox.y = y
-        self.hitbox.x = x - self.extend_x
-        self.hitbox.y = y - self.extend_y
+        if self.space is not None:
+            self.space.update(self)
 
     def move(self):
         """moves body based on velocity and acceleration"""
-        self.xVel += self.xAcc
-        self.yVel += self.yAcc
-        self.x += self.xVel
-        self.y += self.yVel
-
-        if self.xVel < 0:
-            self.xDir = LEFT
-        elif self.xVel > 0:
-            self.xDir = RIGHT
-        else:
-            self.xDir = 0
-
-        if self.yVel < 0:
-            self.yDir = UP
-        elif self.yVel > 0:
-            self.yDir = DOWN
-        else:
-            self.yDir = 0
-
-        if self.xDir == 0 and self.yDir == 0:
-            self.moving = False
-        else:
-            self.moving = True
-            self.goto(self.x, self.y)
+        bodies.move(self.slot)
+        if self.space is not None:
+            self.space.update(self)
 
     def out_of_bounds(self):
         if player.inShop:
@@ -818,89 +2530,230 @@ class Body:
             self.stop_y()
 
     def collide_stage(self, requester=ALL):
-        """checks collision with stage and updates movement accordingly"""
-        diff_x = self.next_x() - self.x
-        diff_y = self.next_y() - self.y
+        """checks collision with stage and updates movement accordingly
 
-        if diff_x < 0:
-            dir_x = LEFT
-        elif diff_x > 0:
-            dir_x = RIGHT
-        else:
-            dir_x = 0
+        the body is swept up or down through every row of tiles it would
+        cross this tick, then sideways through every column, and snapped
+        against the first solid one"""
+        x = self.x   # the store is slow to read, so work on copies
+        y = self.y
+        diff_x = x + self.xVel + self.xAcc - x
+        diff_y = y + self.yVel + self.yAcc - y
+
+        if diff_y != 0:
+            self.sweep_y(x, y, diff_y, requester)
+        if diff_x != 0:
+            self.sweep_x(self.x, self.y, diff_x, requester)
+
+    def gate_row(self, requester, up):
+        """returns the row of the shop entrance if it's shut to the body, or None
+
+        without any coins the player can't pay to go through, so from outside
+        the entrance row is a wall and from inside the row after it is"""
+        if requester != PLAYER or player.coins > 0:
+            return None
+
+        if up and not player.inShop:
+            return SHOP_ENTER_TILE
+        elif not up and player.inShop:
+            return SHOP_ENTER_TILE + 1
+
+        return None
+
+    def sweep_y(self, x, y, diff_y, requester):
+        first_col = col_at(x)
+        last_col = col_at(x + self.w - 1)
+        gate = self.gate_row(requester, diff_y < 0)
 
         if diff_y < 0:
-            dir_y = UP
-        elif diff_y > 0:
-            dir_y = DOWN
+            rows = range(row_at(int(y)), row_at(int(y + diff_y)) - 1, -1)
+            side = BOTTOM
         else:
-            dir_y = 0
-
-        for step in range(1, self.COLLISION_STEPS + 1):
-            left_x = self.x
-            right_x = left_x + self.w - 1
-            top_y = int(self.y + (diff_y * (step / self.COLLISION_STEPS)))
-            bottom_y = top_y + self.h - 1
-
-            if dir_y == UP:
-                if self.grid.collide_horiz(left_x, right_x, top_y, requester):
-                    self.snap_y(row_at(top_y), BOTTOM)
-
-                elif player.coins <= 0 and requester == PLAYER:
-                    if not player.inShop:
-                        if top_y < y_of(SHOP_ENTER_TILE, BOTTOM):
-                            self.snap_y(SHOP_ENTER_TILE, BOTTOM)
-
-            elif dir_y == DOWN:
-                if self.grid.collide_horiz(left_x, right_x, bottom_y, requester):
-                    self.snap_y(row_at(bottom_y), TOP)
-
-                elif player.coins <= 0 and requester == PLAYER:
-                    if player.inShop:
-                        if bottom_y >= y_of(SHOP_ENTER_TILE, BOTTOM) - 1:
-                            self.snap_y(SHOP_ENTER_TILE+1, TOP)
-
-            left_x = int(self.x + (diff_x * (step / 4)))
-            right_x = left_x + self.w - 1
-            top_y = self.y
-            bottom_y = top_y + self.h - 1
-
-            if dir_x == LEFT:
-                if self.grid.collide_vert(left_x, top_y, bottom_y, requester):
-                    self.snap_x(col_at(left_x), RIGHT)
-            elif dir_x == RIGHT:
-                if self.grid.collide_vert(right_x, top_y, bottom_y, requester):
-                    self.snap_x(col_at(right_x), LEFT)
+            rows = range(row_at(int(y) + self.h - 1), row_at(int(y + diff_y) + self.h - 1) + 1)
+            side = TOP
+
+        for row in rows:
+            if row == gate or self.grid.solid_in_row(row, first_col, last_col, requester):
+                self.snap_y(row, side)
+                return
+
+    def sweep_x(self, x, y, diff_x, requester):
+        first_row = row_at(y)
+        last_row = row_at(y + self.h - 1)
+
+        if diff_x < 0:
+            cols = range(col_at(int(x)), col_at(int(x + diff_x)) - 1, -1)
+            side = RIGHT
+        else:
+            cols = range(col_at(int(x) + self.w - 1), col_at(int(x + diff_x) + self.w - 1) + 1)
+            side = LEFT
+
+        for col in cols:
+            if self.grid.solid_in_col(col, first_row, last_row, requester):
+                self.snap_x(col, side)
+                return
 
     def debug_gridbox(self, surf, color=CYAN):
-        pos = camera.pos((self.x, self.y))
+        pos = camera.view(self.lerp_pos())
         x = pos[0]
         y = pos[1]
-        pygame.draw.rect(surf, color, (x, y, self.w, self.h))
+        dirty.add(pygame.draw.rect(surf, color, (x, y, self.w, self.h)))
 
     def debug_hitbox(self, surf, color=RED):
-        pos = camera.pos((self.hitbox.x, self.hitbox.y))
+        x, y = self.lerp_pos()
+        pos = camera.view((x - self.extend_x, y - self.extend_y))
         x = pos[0]
         y = pos[1]
-        pygame.draw.rect(surf, color, (x, y, self.hitbox.w, self.hitbox.h))
+        dirty.add(pygame.draw.rect(surf, color, (x, y, self.hitbox.w, self.hitbox.h)))
+
+
+class Pool:
+    """hands out used up entities again instead of making new ones
+
+    the class needs a reset() that takes the same arguments as it does, and
+    puts the entity back the way it'd be if it was new"""
+    def __init__(self, kind):
+        self.kind = kind
+        self.free = []
+
+        self.made = 0
+        self.reused = 0
+        self.in_use = 0
+        self.most_in_use = 0
+
+    def acquire(self, *args):
+        if self.free:
+            thing = self.free.pop()
+            thing.reset(*args)
+            self.reused += 1
+        else:
+            thing = self.kind(*args)
+            self.made += 1
+
+        self.in_use += 1
+        if self.in_use > self.most_in_use:
+            self.most_in_use = self.in_use
+
+        return thing
+
+    def release(self, thing):
+        self.in_use -= 1
+        self.free.append(thing)
+
+    def stats(self):
+        return ("%s: %d in use, %d free, %d made, %d reused, at most %d in use"
+                % (self.kind.__name__, self.in_use, len(self.free),
+                   self.made, self.reused, self.most_in_use))
+
+
+class Registry:
+    """every entity in the level, kept in one list per kind
+
+    adding an entity gives it a handle: its slot and the generation of the
+    slot, which goes up each time the slot is freed, so get() on a handle to
+    something that's gone returns None instead of whatever took its place.
+    entities remember where they are in their list, and leaving one moves
+    the last entity of that kind into the gap, so nothing is ever searched
+    for.  destroy() only marks an entity, it's taken out in flush() at the
+    end of the tick, so it's safe to destroy things while looping over them"""
+    def __init__(self, pools):
+        self.pools = pools   # where each kind goes back to when it's destroyed
+        self.views = {}
+        self.doomed_counts = {}
+        for kind in pools:
+            self.views[kind] = []
+            self.doomed_counts[kind] = 0
+
+        self.slots = []
+        self.generations = []
+        self.free_slots = []
+        self.doomed = []
+
+    def add(self, thing, kind):
+        if self.free_slots:
+            slot = self.free_slots.pop()
+        else:
+            slot = len(self.slots)
+            self.slots.append(None)
+            self.generations.append(0)
+
+        self.slots[slot] = thing
+        thing.handle = (slot, self.generations[slot])
+        thing.destroyed = False
+        self.join(thing, kind)
+        return thing.handle
+
+    def get(self, handle):
+        """returns the entity a handle is for, or None if it's gone"""
+        slot, generation = handle
+        if self.generations[slot] == generation:
+            return self.slots[slot]
+
+        return None
+
+    def join(self, thing, kind):
+        view = self.views[kind]
+        thing.kind = kind
+        thing.view_index = len(view)
+        view.append(thing)
+
+    def leave(self, thing):
+        view = self.views[thing.kind]
+        last = view.pop()
+        if last is not thing:
+            view[thing.view_index] = last
+            last.view_index = thing.view_index
+
+    def transfer(self, thing, kind):
+        """moves an entity into another kind's list straight away"""
+        self.leave(thing)
+        self.join(thing, kind)
+
+    def destroy(self, thing):
+        """takes the entity out of its spatial hash, and out of the level at the end of the tick"""
+        if not thing.destroyed:
+            thing.destroyed = True
+            self.doomed.append(thing)
+            self.doomed_counts[thing.kind] += 1
+            if thing.body.space is not None:
+                thing.body.space.remove(thing)
+
+    def flush(self):
+        """removes everything destroyed this tick"""
+        for thing in self.doomed:
+            self.leave(thing)
+            slot = thing.handle[0]
+            self.slots[slot] = None
+            self.generations[slot] += 1
+            self.free_slots.append(slot)
+            self.pools[thing.kind].release(thing)
+
+        self.doomed = []
+        for kind in self.doomed_counts:
+            self.doomed_counts[kind] = 0
+
+    def view(self, kind):
+        """returns the list of a kind, destroyed ones included until the tick ends"""
+        return self.views[kind]
+
+    def count(self, kind):
+        """returns how many of a kind there are, not counting destroyed ones"""
+        return len(self.views[kind]) - self.doomed_counts[kind]
 
 
 class Bullet:
     def __init__(self, x_vel, y_vel, x, y, w, h, extend_x=0, extend_y=0):
         self.body = Body(x, y, w, h, extend_x, extend_y)
-        self.body.xVel = x_vel
-        self.body.yVel = y_vel
-
         self.sprite = SpriteInstance(PLAYER_BULLET_SPRITE_SHEET)
-        self.sprite.current_frame = random.randint(0, 3)
+        self.reset(x_vel, y_vel, x, y, w, h, extend_x, extend_y)
 
-    def in_wall(self):
-        col = col_at(self.body.next_x())
-        row = row_at(self.body.next_y())
-        if grid.is_solid(col, row):
-            return True
+    def reset(self, x_vel, y_vel, x, y, w, h, extend_x=0, extend_y=0):
+        self.body.reset(x, y, w, h, extend_x, extend_y)
+        self.body.xVel = x_vel
+        self.body.yVel = y_vel
 
-        return False
+        self.sprite.reset()
+        self.sprite.current_frame = rng.randint(0, 3)
 
 
 class Player:
@@ -916,19 +2769,33 @@ class Player:
         self.body = Body(x, y, w, h, extend_x, extend_y)
         self.sprite = SpriteInstance(PLAYER_SPRITE_SHEET)
         self.sprite.current_frame = 1
-        self.bullets = []
-        self.dying_bullets = []
         self.bullet_timer = 0
 
-        self.corpse_count = 0
-        self.corpses = []
         self.corpse_speeds = (6, 4, 3.2, 2.5, 2, 1.7)
 
+        self.selected_corpse = None   # a handle, the corpse might be gone by the time it's drawn
+
         self.coins = self.INITIAL_COINS
         self.inShop = True
         self.enteredShop = False
         self.exitShop = False
 
+    @property
+    def bullets(self):
+        return registry.view(BULLETS)
+
+    @property
+    def dying_bullets(self):
+        return registry.view(DYING_BULLETS)
+
+    @property
+    def corpses(self):
+        return registry.view(CORPSES)
+
+    @property
+    def corpse_count(self):
+        return registry.count(CORPSES)
+
     def update_room(self):
         if self.enteredShop:
             self.enteredShop = False
@@ -939,6 +2806,7 @@ class Player:
             if self.body.pos_center()[1] > SHOP_ENTER:
                 self.inShop = False
                 self.exitShop = True
+                music.fade_to(MUSIC_UNDERWORLD)
                 self.change_coins(-1)
                 coin_handler.add(-1)
 
@@ -946,11 +2814,12 @@ class Player:
             if self.body.pos_center()[1] < SHOP_ENTER:
                 self.inShop = True
                 self.enteredShop = True
+                music.fade_to(MUSIC_SHOP)
                 self.change_coins(-1)
                 coin_handler.add(-1)
-                for coin in reversed(range(coin_handler.ground_coin_count)):
+                for coin in coin_handler.coins:
                     coin_handler.delete_coin(coin)
-                for enemy in reversed(enemyHandler.enemies):
+                for enemy in enemyHandler.enemies:
                     if enemy.dead:
                         enemy.delete()
 
@@ -968,6 +2837,7 @@ class Player:
         self.body.xVel = self.corpse_speeds[self.corpse_count]
 
     def handle_movement(self):
+        keys = user_input.state.keys
         if keys[pygame.K_UP] or keys[pygame.K_w]:
             self.move_up()
         elif keys[pygame.K_DOWN] or keys[pygame.K_s]:
@@ -988,20 +2858,21 @@ class Player:
         self.update_room()
 
     def move_bullets(self):
-        i = len(self.bullets)
-        for bullet in reversed(self.bullets):
-            i -= 1
-            if bullet.in_wall():
-                self.destroy_bullet(i)
-            else:
-                bullet.body.move()
+        """destroys bullets about to go into a wall and moves the rest"""
+        group = [bullet.body for bullet in self.bullets]
+        next_x, next_y = bodies.next_positions(group)
+        for bullet, x, y in zip(list(self.bullets), next_x, next_y):
+            if grid.is_solid(col_at(x), row_at(y)):
+                self.destroy_bullet(bullet)
+
+        bodies.integrate([bullet.body for bullet in self.bullets])
 
-    def destroy_bullet(self, index):
-        self.dying_bullets.append(self.bullets[index])
-        del self.bullets[index]
+    def destroy_bullet(self, bullet):
+        bullet_space.remove(bullet)
+        registry.transfer(bullet, DYING_BULLETS)
 
     def gun_pos(self):
-        angle = angle_of(self.body.screen_pos_center(), mouse_pos)
+        angle = angle_of(self.body.screen_pos_center(), user_input.state.mouse_pos)
         gun_pos = angle_pos(self.body.pos_center(), angle, PIXEL*7)
         return int(gun_pos[0]), int(gun_pos[1])
 
@@ -1011,15 +2882,17 @@ class Player:
         return int(gun_pos[0] - player_pos[0]), int(gun_pos[1] - player_pos[1])
 
     def shoot(self):
-        angle = angle_of(self.body.screen_pos_center(), mouse_pos)
+        angle = angle_of(self.body.screen_pos_center(), user_input.state.mouse_pos)
         vel = angle_pos((0, 0), angle, 8)
         gun_pos = self.gun_pos()
         x = gun_pos[0] - PLAYER_BULLET_SPRITE_SHEET.frame_w / 2
         y = gun_pos[1] - PLAYER_BULLET_SPRITE_SHEET.frame_h / 2
         pos = angle_pos((x, y), angle, 5)
 
-        self.bullets.append(Bullet(vel[0], vel[1], pos[0], pos[1],
-                                   self.BULLET_SIZE, self.BULLET_SIZE))
+        bullet = bullet_pool.acquire(vel[0], vel[1], pos[0], pos[1],
+                                     self.BULLET_SIZE, self.BULLET_SIZE)
+        registry.add(bullet, BULLETS)
+        bullet_space.add(bullet)
 
         soundboard.play(SOUND_SHOOT)
 
@@ -1030,9 +2903,9 @@ class Player:
         else:
             self.bullet_timer -= 1
 
-    def draw(self, surf):
-        """draws the player"""
-        angle = angle_of(camera.pos(player.body.pos_center()), mouse_pos)
+    def animate(self):
+        """faces the player towards the mouse"""
+        angle = angle_of(camera.pos(player.body.pos_center()), user_input.state.mouse_pos)
         # debug(20, angle)
         if math.pi * -(3/4) < angle < math.pi * -(1/4):
             direction = UP
@@ -1050,45 +2923,28 @@ class Player:
             self.sprite.change_anim(IDLE)
             self.sprite.set_frame(direction - 1)
 
-        x = self.body.x
-        y = self.body.y - self.sprite.sheet.z_height
-
-        surf.blit(self.sprite.get_now_frame(), camera.pos((x, y)))
-
-    def draw_gun(self, surf):
-        """draw, as in artistically"""
-        if mouse_pos[0] < camera.pos(player.body.pos_center())[0]:
+    def animate_gun(self):
+        if user_input.state.mouse_pos[0] < camera.pos(player.body.pos_center())[0]:
             fairy_sprite.change_anim(0)
         else:
             fairy_sprite.change_anim(1)
         fairy_sprite.delay_next(6)
 
-        position = camera.pos(self.gun_pos())
-        x = position[0] - fairy_sprite.sheet.frame_w / 2
-        y = position[1] - fairy_sprite.sheet.frame_h / 2 - PIXEL
-        surf.blit(fairy_sprite.get_now_frame(), (x, y))
-
-    def draw_bullets(self, surf):
-        """draws all of the player's bullets"""
+    def animate_bullets(self):
         for bullet in self.bullets:
             bullet.sprite.delay_next(2)
-            pos = camera.pos((bullet.body.x, bullet.body.y))
-            surf.blit(bullet.sprite.get_now_frame(), pos)
-
-        i = len(self.dying_bullets)
-        for bullet in reversed(self.dying_bullets):
-            i -= 1
 
+        for bullet in self.dying_bullets:
+            # the last frame gets shown for one tick before it goes away
             bullet.sprite.change_anim(BULLET_DIE)
-            bullet.sprite.delay_next(2)
-            pos = camera.pos((bullet.body.x, bullet.body.y))
-            surf.blit(bullet.sprite.get_now_frame(), pos)
-
             last_frame = bullet.sprite.sheet.frame_counts[BULLET_DIE] - 1
             if bullet.sprite.current_frame == last_frame:
-                del self.dying_bullets[i]
+                registry.destroy(bullet)
+            else:
+                bullet.sprite.delay_next(2)
 
-    def draw_corpses(self, surf):
+    def carry_corpses(self):
+        """stacks the corpses being carried on top of the player"""
         y = self.body.y - self.sprite.sheet.z_height + PIXEL
 
         if self.sprite.current_anim != IDLE and self.sprite.current_frame == 2:
@@ -1098,52 +2954,76 @@ class Player:
             x = self.body.x + (self.body.w / 2 - corpse.body.w / 2)
             y -= corpse.body.h
             corpse.body.goto(x, y)
+            corpse.animate()
+
+    def draw(self, surf):
+        """draws the player"""
+        x, y = self.body.lerp_pos()
+        y -= self.sprite.sheet.z_height
+
+        dirty.blit(surf, self.sprite.get_now_frame(), camera.view((x, y)))
+
+    def draw_gun(self, surf):
+        """draw, as in artistically"""
+        x, y = self.body.lerp_pos()
+        gun_x, gun_y = self.gun_pos()
+        position = camera.view((gun_x + x - self.body.x, gun_y + y - self.body.y))
+        x = position[0] - fairy_sprite.sheet.frame_w / 2
+        y = position[1] - fairy_sprite.sheet.frame_h / 2 - PIXEL
+        dirty.blit(surf, fairy_sprite.get_now_frame(), (x, y))
+
+    def draw_bullets(self, surf):
+        """draws all of the player's bullets"""
+        for bullet in self.bullets:
+            pos = camera.view(bullet.body.lerp_pos())
+            dirty.blit(surf, bullet.sprite.get_now_frame(), pos)
+
+        for bullet in reversed(self.dying_bullets):
+            pos = camera.view(bullet.body.lerp_pos())
+            dirty.blit(surf, bullet.sprite.get_now_frame(), pos)
+
+    def draw_corpses(self, surf):
+        for corpse in self.corpses:
             corpse.draw(surf)
 
+    def draw_all(self, surf):
+        """draws the player and everything that comes with them"""
+        if self.selected_corpse:
+            corpse = registry.get(self.selected_corpse)
+            if corpse:
+                corpse.draw_selected()
+
+        self.draw_bullets(surf)
+        if not self.inShop:
+            self.draw_gun(surf)
+
+        self.draw(surf)
+        self.draw_corpses(surf)
+
     def check_hit(self, enemy):
         """determines if a bullet hits an enemy"""
-        i = len(self.bullets)
-        for bullet in self.bullets:
-            i -= 1
-            if collide(enemy.body.hitbox, bullet.body.hitbox):
-                enemy.health.change(-1)
-                self.destroy_bullet(i)
+        for bullet in bullet_space.overlapping(enemy.body.hitbox):
+            enemy.health.change(-1)
+            self.destroy_bullet(bullet)
 
     def select_corpse(self):
         """returns the closest corpse to mouse within pickup range"""
-        lowest_dist = SCRN_W * 2   # just a really big number
-        lowest_dist_enemy = None
-        for enemy in enemyHandler.enemies:
-            if enemy.dead:
-                player_dist = body_distance(player.body, enemy.body)
-
-                if player_dist < self.PICKUP_DISTANCE:
-                    enemy_pos = camera.pos(enemy.body.pos_center())
-                    mouse_dist = distance(mouse_pos, enemy_pos)
-
-                    if mouse_dist < lowest_dist:
-                        lowest_dist = mouse_dist
-                        lowest_dist_enemy = enemy
-
-        return lowest_dist_enemy
+        return corpse_space.closest_in_range(camera.world_pos(user_input.state.mouse_pos),
+                                             self.body.pos_center(), self.PICKUP_DISTANCE)
 
     def collect_coins(self):
-        i = coin_handler.ground_coin_count
         collected = False
-        for coin in reversed(coin_handler.coins):
-            i -= 1
-            if collide(coin.body.gridbox, player.body.gridbox):
-                coin_handler.delete_coin(i)
-                self.change_coins(1)
-                collected = True
+        for coin in coin_space.overlapping(player.body.gridbox):
+            coin_handler.delete_coin(coin)
+            self.change_coins(1)
+            collected = True
         if collected:
             soundboard.play(SOUND_COLLECT)
 
     def pickup_corpse(self, enemy):
         if self.corpse_count < self.MAX_CORPSES:
-            self.corpse_count += 1
-            self.corpses.append(enemy)
-            enemy.delete()
+            corpse_space.remove(enemy)
+            registry.transfer(enemy, CORPSES)
 
     def sell_corpses(self):
         if self.corpse_count != 0:
@@ -1151,8 +3031,8 @@ class Player:
                 coin_handler.spawn_coin_drop((300, 100))
                 coin_handler.add(1)
 
-            self.corpse_count = 0
-            self.corpses = []
+            for corpse in self.corpses:
+                registry.destroy(corpse)
 
             soundboard.play(SOUND_SELL)
 
@@ -1161,31 +3041,31 @@ class Player:
         coin_counter.change(amount)
 
     def update(self):
-        if mouse_pressed[0]:
+        state = user_input.state
+        if state.buttons[0]:
             player.try_shoot()
         else:
             player.bullet_timer = 0
 
-        selected_corpse = self.select_corpse()
-        if selected_corpse:
-            if right_mouse_released:
-                self.pickup_corpse(selected_corpse)
-            else:
-                selected_corpse.draw_selected()
+        corpse = self.select_corpse()
+        self.selected_corpse = corpse.handle if corpse else None
+        if corpse and state.released[2]:
+            self.pickup_corpse(corpse)
+            self.selected_corpse = None
 
-        if self.inShop and right_mouse_released:
+        if self.inShop and state.released[2]:
             self.sell_corpses()
 
         self.sprite.delay_next(4)
 
         self.handle_movement()
         self.move_bullets()
-        self.draw_bullets(postSurf)
+        self.animate_bullets()
         if not self.inShop:
-            self.draw_gun(postSurf)
+            self.animate_gun()
 
-        self.draw(postSurf)
-        self.draw_corpses(postSurf)
+        self.animate()
+        self.carry_corpses()
         self.collect_coins()
 
 
@@ -1196,23 +3076,25 @@ class Coin:
     def __init__(self, pos, thrown=False):
         self.body = Body(pos[0], pos[1], PIXEL*7, PIXEL*7)
         self.sprite = SpriteInstance(COIN_SPRITE_SHEET)
+        self.reset(pos, thrown)
+
+    def reset(self, pos, thrown=False):
+        self.body.reset(pos[0], pos[1], PIXEL*7, PIXEL*7)
+        self.sprite.reset()
         if thrown:
-            angle = random.vonmisesvariate(0, 0) - math.pi
+            angle = rng.vonmisesvariate(0, 0) - math.pi
             vel = angle_pos((0, 0), angle, self.SPEED)
             self.body.xVel = vel[0]
             self.body.yVel = vel[1]
 
     def draw(self):
-        pos = camera.pos((self.body.x, self.body.y))
-        postSurf.blit(self.sprite.get_now_frame(), pos)
+        pos = camera.view(self.body.lerp_pos())
+        dirty.blit(postSurf, self.sprite.get_now_frame(), pos)
 
     def update(self):
-        self.body.xVel /= self.SLOWDOWN
-        self.body.yVel /= self.SLOWDOWN
+        """the handler slows down all the coins before this and moves them after"""
         self.body.collide_stage()
-        self.body.move()
 
-        self.draw()
         self.sprite.delay_next(6)
 
 
@@ -1221,35 +3103,39 @@ class CoinHandler:
     INITIAL_COINS = 8
 
     def __init__(self):
-        self.coins = []
-        self.ground_coin_count = 0
         self.coin_count = player.INITIAL_COINS
 
+    @property
+    def coins(self):
+        return registry.view(COINS)
+
     def update_coins(self):
-        for coin in self.coins:
+        coins = [coin for coin in self.coins if not coin.destroyed]
+        group = [coin.body for coin in coins]
+        bodies.damp(group, Coin.SLOWDOWN)
+        for coin in coins:
             coin.update()
+        bodies.integrate(group)
+
+    def draw_coins(self):
+        for coin in self.coins:
+            coin.draw()
 
     def spawn_coin(self, pos):
-        self.ground_coin_count += 1
-        self.coins.append(Coin(pos))
+        coin = coin_pool.acquire(pos)
+        registry.add(coin, COINS)
+        coin_space.add(coin)
 
     def spawn_coin_drop(self, pos):
-        self.ground_coin_count += 1
-        self.coins.append(Coin(pos, True))
+        coin = coin_pool.acquire(pos, True)
+        registry.add(coin, COINS)
+        coin_space.add(coin)
 
     def add(self, amount):
         self.coin_count += amount
 
-    def delete_coin(self, i):
-        del self.coins[i]
-        self.ground_coin_count -= 1
-
-    def out_of_bounds_fix(self):
-        i = self.ground_coin_count
-        for coin in reversed(self.coins):
-            i -= 1
-            if grid.tile_at(coin.x, coin.y) == VOID:
-                self.delete_coin(i)
+    def delete_coin(self, coin):
+        registry.destroy(coin)
 
 
 class Health:
@@ -1282,7 +3168,7 @@ class Health:
         self.w = self.MAX_W
 
     def draw(self, surf, pos, color):
-        pygame.draw.rect(surf, color, (pos[0], pos[1], self.w, self.MAX_H))
+        dirty.add(pygame.draw.rect(surf, color, (pos[0], pos[1], self.w, self.MAX_H)))
 
     def zero(self):
         if self.current <= 0:
@@ -1295,12 +3181,21 @@ class EnemyHandler:
     MAX_ENEMIES = 7
 
     def __init__(self):
-        self.enemies = []
-        self.enemy_count = 0
         self.spawn_timer = 120
+        self.spawning = True
+        self.enemy_count = 0   # hounds still alive, counted again every update
+
+    @property
+    def enemies(self):
+        return registry.view(HOUNDS)
 
     def update(self):
+        hound_paths.aim(player.body.pos_center())
+        alive = 0
         for enemy in self.enemies:
+            if enemy.destroyed:
+                continue
+
             if not enemy.dead:
                 enemy.move()
             else:
@@ -1316,35 +3211,38 @@ class EnemyHandler:
                 else:
                     enemy.remove()
 
-            if not enemy.removed:
-                enemy.draw_health()
-
-            enemy.draw(postSurf)
+            enemy.animate()
+            if not (enemy.dead or enemy.removed or enemy.destroyed):
+                alive += 1
 
+        self.enemy_count = alive
         if self.spawn_timer == 0:
-            if not player.inShop and self.enemy_count < self.MAX_ENEMIES:
+            if self.spawning and not player.inShop and self.enemy_count < self.MAX_ENEMIES:
                 self.random_enemy_spawn()
-                self.enemy_count += 1
                 self.spawn_timer = 60 + self.enemy_count * 30
         else:
             self.spawn_timer -= 1
 
+    def draw(self, surf):
+        for enemy in self.enemies:
+            if not enemy.removed:
+                enemy.draw_health()
+
+            enemy.draw(surf)
+
     def random_enemy_spawn(self):
-        enemy_type = random.randint(0, 0)
+        enemy_type = rng.randint(0, 0)
         if enemy_type == 0:
-            rng = random.random()
-            if rng < 0.66:
-                x = random.choice((-50, grid.FULL_W + 50))
-                y = random.randint(SHOP_ENTER, grid.FULL_H + 50)
-            else:
-                x = random.randint(-50, grid.FULL_W + 50)
-                y = grid.FULL_H + 50
-
-            self.enemies.append(Shadowhound(x, y))
+            x, y = level.spawn_point()
+            hound = hound_pool.acquire(x, y)
+            registry.add(hound, HOUNDS)
+            enemy_space.add(hound)
+            self.enemy_count += 1
 
     def kill_all(self):
         for enemy in self.enemies:
             enemy.die()
+        self.enemy_count = 0
 
 
 class Shadowhound:
@@ -1371,6 +3269,14 @@ class Shadowhound:
     def __init__(self, x, y):
         self.body = Body(x, y, PIXEL*11, PIXEL*3)
         self.health = Health(self.ALIVE_HEALTH)
+        self.sprite = SpriteInstance(self.SHEET)
+        self.sprite.sheet.init_z_height(self.body)
+        self.reset(x, y)
+
+    def reset(self, x, y):
+        self.body.reset(x, y, PIXEL*11, PIXEL*3)
+        self.health.set_max(self.ALIVE_HEALTH)
+        self.health.refill()
         self.cycle = 120
         self.timer = self.DASH_TIME + self.WAIT_TIME
         self.dead = False
@@ -1378,8 +3284,7 @@ class Shadowhound:
         self.hasCoin = False
         self.movingTowards = True
 
-        self.sprite = SpriteInstance(self.SHEET)
-        self.sprite.sheet.init_z_height(self.body)
+        self.sprite.reset()
         self.direction = LEFT
         self.dead_sprite = False
 
@@ -1387,7 +3292,7 @@ class Shadowhound:
 
         away_angle = -1.5
         while -2.8 < away_angle < 0.8:
-            away_angle = math.radians(random.randint(-180, 180))
+            away_angle = math.radians(rng.randint(-180, 180))
 
         vel = angle_pos((0, 0), away_angle, self.RUN_SPEED)
         self.away_x_vel = vel[0]
@@ -1399,6 +3304,18 @@ class Shadowhound:
         self.body.xVel = vel[0]
         self.body.yVel = vel[1]
 
+    def steer(self):
+        """heads around whatever's between you and the player, if anything
+
+        returns False when the way is clear, so the dash stays a straight line"""
+        way = hound_paths.steer(self.body.pos_center())
+        if way is None:
+            return False
+
+        self.body.xVel = way[0] * self.DASH_SPEED
+        self.body.yVel = way[1] * self.DASH_SPEED
+        return True
+
     def land(self):
         self.body.stop_x()
         self.body.stop_y()
@@ -1411,13 +3328,14 @@ class Shadowhound:
                 if self.hasCoin or player.inShop or player.coins <= 0:
                     self.movingTowards = False
 
-                else:
+                elif not self.steer():
                     player_pos = player.body.pos_center()
                     self_pos = self.body.pos_center()
                     angle = angle_of(self_pos, player_pos)
                     self.change_vel(angle, self.DASH_SPEED)
 
             elif self.timer > self.WAIT_TIME:
+                self.steer()
                 self.body.collide_stage(ENEMY)
                 self.body.move()
 
@@ -1450,11 +3368,10 @@ class Shadowhound:
                 if self.hasCoin:
                     coin_handler.add(-1)
                 self.delete()
-                enemyHandler.enemy_count -= 1
 
     # foolishly, now i have to make a draw, die, and remove command for
     # EVERY enemy type
-    def draw(self, surf):
+    def animate(self):
         if self.removed:
             self.sprite.delay_next(4)
 
@@ -1476,10 +3393,10 @@ class Shadowhound:
                     if self.sprite.delay == 1:
                         if self.direction == RIGHT:
                             self.sprite.change_anim(self.DIEDLE_RIGHT)
-                            self.sprite.current_frame = random.randint(0, 2)
+                            self.sprite.current_frame = rng.randint(0, 2)
                         else:
                             self.sprite.change_anim(self.DIEDLE_LEFT)
-                            self.sprite.current_frame = random.randint(0, 2)
+                            self.sprite.current_frame = rng.randint(0, 2)
 
                         self.dead_sprite = True
 
@@ -1507,29 +3424,34 @@ class Shadowhound:
             else:
                 self.sprite.delay_next(4)
 
-        position = (self.body.x, self.body.y - self.sprite.sheet.z_height)
-        position = camera.pos(position)
-        surf.blit(self.sprite.get_now_frame(), position)
+    def draw(self, surf):
+        x, y = self.body.lerp_pos()
+        position = camera.view((x, y - self.sprite.sheet.z_height))
+        dirty.blit(surf, self.sprite.get_now_frame(), position)
 
     def draw_selected(self):
         if self.dead and 7 <= self.sprite.current_anim <= 8:
             anim = self.sprite.current_anim
             frame = self.sprite.current_frame + 3
 
-            pos = (self.body.x, self.body.y - self.sprite.sheet.z_height)
-            pos = camera.pos(pos)
-            postSurf.blit(self.sprite.sheet.get_frame(anim, frame), pos)
+            x, y = self.body.lerp_pos()
+            pos = camera.view((x, y - self.sprite.sheet.z_height))
+            dirty.blit(postSurf, self.sprite.sheet.get_frame(anim, frame), pos)
 
     def draw_health(self):
-        x = self.body.pos_center()[0] - int(self.health.MAX_W / 2)
-        y = self.body.y - PIXEL * 7
+        x, y = self.body.lerp_pos()
+        x += int(self.body.w / 2) - int(self.health.MAX_W / 2)
+        y -= PIXEL * 7
         if self.dead:
-            self.health.draw(postSurf, camera.pos((x, y)), BLOOD_PURPLE)
+            self.health.draw(postSurf, camera.view((x, y)), BLOOD_PURPLE)
         else:
-            self.health.draw(postSurf, camera.pos((x, y)), RED)
+            self.health.draw(postSurf, camera.view((x, y)), RED)
 
     def die(self):
-        enemyHandler.enemy_count -= 1
+        if self.body.space is enemy_space:   # it can be picked up now
+            enemy_space.remove(self)
+            corpse_space.add(self)
+
         self.dead = True
         self.health.set_max(self.CORPSE_HEALTH)
         self.health.refill()
@@ -1539,17 +3461,19 @@ class Shadowhound:
             self.hasCoin = False
 
     def remove(self):
+        if self.body.space is corpse_space:
+            corpse_space.remove(self)
+
         self.removed = True
         self.dead = False
         if self.direction == LEFT:
             self.sprite.change_anim(self.REMOVE_LEFT)
         else:
             self.sprite.change_anim(self.REMOVE_RIGHT)
-        soundboard.play(random.choice(SOUND_SQUELCH))
+        soundboard.play(rng.choice(SOUND_SQUELCH))
 
     def delete(self):
-        if self in enemyHandler.enemies:
-            enemyHandler.enemies.remove(self)
+        registry.destroy(self)
 
 
 class UnderworldKing:
@@ -1574,12 +3498,11 @@ class UnderworldKing:
         self.body.move()
 
     def draw(self, surf):
-        position = camera.pos((self.body.x, self.body.y))
-        surf.blit(self.sprite.get_now_frame(), position)
+        position = camera.view(self.body.lerp_pos())
+        dirty.blit(surf, self.sprite.get_now_frame(), position)
 
     def update(self):
         self.move()
-        self.draw(postSurf)
 
     def collide_player(self):
         if collide(self.body.hitbox, player.body.hitbox):
@@ -1588,69 +3511,415 @@ class UnderworldKing:
         return False
 
 
+class KeySet:
+    """the keys held down, looked up like pygame.key.get_pressed()"""
+    def __init__(self, held=()):
+        self.held = frozenset(held)
+
+    def __getitem__(self, key):
+        return key in self.held
+
+
+# one frame's input, never changed once it's made.  buttons, pressed and
+# released are the left, middle and right mouse buttons
+InputState = collections.namedtuple("InputState", "keys mouse_pos buttons pressed released")
+NO_BUTTONS = (False, False, False)
+
+
+class Input:
+    """the mouse and keyboard, read once a frame into input.state
+
+    nothing else takes events off the queue or asks pygame what's held.  a
+    key or button counts as down if it was down at any point in the frame,
+    so taps shorter than a frame aren't lost.  presses and releases stay in
+    the state until a tick's seen them, even through frames with no ticks"""
+    def __init__(self):
+        self.keys = set()
+        self.held = NO_BUTTONS
+        self.state = InputState(KeySet(), (0, 0), NO_BUTTONS, NO_BUTTONS, NO_BUTTONS)
+
+    def poll(self):
+        """empties the event queue into a new state"""
+        tapped = set()
+        buttons = list(self.held)
+        held = list(self.held)
+        pressed = list(self.state.pressed)
+        released = list(self.state.released)
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                sys.exit()
+
+            elif event.type == pygame.KEYDOWN:
+                self.keys.add(event.key)
+                tapped.add(event.key)
+
+            elif event.type == pygame.KEYUP:
+                self.keys.discard(event.key)
+
+            elif event.type == pygame.MOUSEBUTTONDOWN and event.button <= 3:
+                buttons[event.button - 1] = True
+                held[event.button - 1] = True
+                pressed[event.button - 1] = True
+
+            elif event.type == pygame.MOUSEBUTTONUP and event.button <= 3:
+                held[event.button - 1] = False
+                released[event.button - 1] = True
+
+        self.held = tuple(held)
+        self.state = InputState(KeySet(self.keys | tapped), pygame.mouse.get_pos(),
+                                tuple(buttons), tuple(pressed), tuple(released))
+
+    def feed(self, keys, mouse_pos, buttons):
+        """makes the state from input that came from somewhere else"""
+        pressed = tuple(was_pressed or (down and not was_down) for was_pressed, down, was_down
+                        in zip(self.state.pressed, buttons, self.held))
+        released = tuple(was_released or (was_down and not down) for was_released, down, was_down
+                         in zip(self.state.released, buttons, self.held))
+        self.held = tuple(buttons)
+        self.state = InputState(keys, mouse_pos, self.held, pressed, released)
+
+    def seen(self):
+        """a tick's had its chance at the presses and releases, so drops them"""
+        if self.state.pressed != NO_BUTTONS or self.state.released != NO_BUTTONS:
+            self.state = self.state._replace(pressed=NO_BUTTONS, released=NO_BUTTONS)
+
+
+class Replay:
+    """the seed a game started with and the input every tick of it saw
+
+    since everything the game rolls comes out of rng, that's all it takes
+    to play it again exactly the same.  each tick's input is a record of the
+    keys that move the player, the mouse position, and a bit for each mouse
+    button being down, pressed and released.
+
+    the ticks are split into blocks of BLOCK_TICKS, and each block starts
+    with a keyframe of the whole world, so seeking only has to load the
+    keyframe before and play forward from there.  in a block the input is
+    stored as runs of ticks that saw the same thing, and the block gets
+    compressed once it's over.  a recording's kept in memory and saved when
+    the game closes"""
+    MAGIC = b"LDR"
+    VERSION = 2
+    HEADER = struct.Struct("<3sBqII")   # magic, version, seed, tick count, block count
+    SIZE = struct.Struct("<I")   # a block's size, or a keyframe's at the start of one
+    RUN = struct.Struct("<H")   # how many ticks a record lasts
+    TICK = struct.Struct("<BhhH")   # keys, mouse x, mouse y, buttons
+    MOUSE_MIN = -0x8000   # the mouse positions TICK can hold
+    MOUSE_MAX = 0x7FFF
+    BLOCK_TICKS = FPS * 5
+    KEYS = (pygame.K_UP, pygame.K_w, pygame.K_DOWN, pygame.K_s,
+            pygame.K_LEFT, pygame.K_a, pygame.K_RIGHT, pygame.K_d)
+
+    def __init__(self, seed):
+        self.seed = seed
+        self.length = 0   # in ticks
+        self.blocks = []   # compressed
+        self.playing = False
+        self.position = 0   # the next tick to record or play
+
+        self.keyframe = None   # of the block being recorded
+        self.runs = []   # [ticks, record] of the block being recorded
+        self.block_id = None   # of the block being played
+        self.records = []   # of the block being played, one per tick
+
+    def __len__(self):
+        return self.length
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as file:
+            data = file.read()
+
+        magic, version, seed, length, count = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError("%s isn't a replay this version can play" % path)
+
+        replay = cls(seed)
+        replay.length = length
+        replay.playing = True
+        offset = cls.HEADER.size + cls.SIZE.size * count
+        for size, in cls.SIZE.iter_unpack(data[cls.HEADER.size:offset]):
+            replay.blocks.append(data[offset:offset + size])
+            offset += size
+
+        return replay
+
+    def save(self, path):
+        self.end_block()
+        with open(path + ".tmp", "wb") as file:
+            file.write(self.HEADER.pack(self.MAGIC, self.VERSION, self.seed,
+                                        self.length, len(self.blocks)))
+            for block in self.blocks:
+                file.write(self.SIZE.pack(len(block)))
+            for block in self.blocks:
+                file.write(block)
+        os.replace(path + ".tmp", path)
+
+    def end_block(self):
+        """compresses the block that's been recorded so far"""
+        if self.keyframe is None:
+            return
+
+        data = [self.SIZE.pack(len(self.keyframe)), self.keyframe]
+        for ticks, record in self.runs:
+            data.append(self.RUN.pack(ticks))
+            data.append(record)
+        self.blocks.append(zlib.compress(b"".join(data)))
+
+        self.keyframe = None
+        self.runs = []
+
+    def record(self, state):
+        """adds a tick's input, returning it the way it'll play back
+
+        a mouse position too far off the screen to save gets pulled in
+        first, so the game sees the same thing recording it as playing it"""
+        if self.position % self.BLOCK_TICKS == 0:
+            self.end_block()
+            self.keyframe = save_world()
+
+        keys = 0
+        for bit, key in enumerate(self.KEYS):
+            if state.keys[key]:
+                keys |= 1 << bit
+
+        buttons = 0
+        for bit, down in enumerate(state.buttons + state.pressed + state.released):
+            if down:
+                buttons |= 1 << bit
+
+        x = min(max(int(state.mouse_pos[0]), self.MOUSE_MIN), self.MOUSE_MAX)
+        y = min(max(int(state.mouse_pos[1]), self.MOUSE_MIN), self.MOUSE_MAX)
+        if (x, y) != state.mouse_pos:
+            state = state._replace(mouse_pos=(x, y))
+
+        record = self.TICK.pack(keys, x, y, buttons)
+        if self.runs and self.runs[-1][1] == record and self.runs[-1][0] < 0xFFFF:
+            self.runs[-1][0] += 1
+        else:
+            self.runs.append([1, record])
+
+        self.position += 1
+        self.length = self.position
+        return state
+
+    def open_block(self, block_id):
+        """unpacks a block's input to play, returns its keyframe"""
+        data = zlib.decompress(self.blocks[block_id])
+        size, = self.SIZE.unpack_from(data)
+        offset = self.SIZE.size + size
+        keyframe = data[self.SIZE.size:offset]
+
+        self.records = []
+        while offset < len(data):
+            ticks, = self.RUN.unpack_from(data, offset)
+            offset += self.RUN.size
+            self.records.extend([data[offset:offset + self.TICK.size]] * ticks)
+            offset += self.TICK.size
+
+        self.block_id = block_id
+        return keyframe
+
+    def play(self):
+        """returns the input the next tick saw, or None once it's all been played"""
+        if self.position >= self.length:
+            return None
+
+        block_id, tick = divmod(self.position, self.BLOCK_TICKS)
+        if block_id != self.block_id:
+            self.open_block(block_id)
+
+        keys, x, y, buttons = self.TICK.unpack(self.records[tick])
+        self.position += 1
+        down = [bool(buttons >> bit & 1) for bit in range(9)]
+        return InputState(KeySet(key for bit, key in enumerate(self.KEYS) if keys >> bit & 1),
+                          (x, y), tuple(down[0:3]), tuple(down[3:6]), tuple(down[6:9]))
+
+    def rewind(self, tick):
+        """goes back to the start of the block a tick's in, returns its keyframe"""
+        block_id = min(tick, self.length - 1) // self.BLOCK_TICKS
+        self.position = block_id * self.BLOCK_TICKS
+        return self.open_block(block_id)
+
+    def step(self, controls):
+        """records the input a tick's about to see, or swaps in what it saw
+        last time.  returns False once there's none left to play"""
+        if not self.playing:
+            controls.state = self.record(controls.state)
+            return True
+
+        state = self.play()
+        if state is None:
+            return False
+
+        controls.state = state
+        return True
+
+
+if args.replay:
+    replay = Replay.load(args.replay)
+    seed = replay.seed
+    rng.seed(seed)   # nothing's rolled yet, so it's as if it started with it
+elif args.record:
+    replay = Replay(seed)
+    atexit.register(replay.save, args.record)
+
+
+class InputScript:
+    """input read from a file instead of the mouse and keyboard
+
+    each line is "tick keys mouse_x mouse_y buttons", like "90 sd 400 300 100".
+    keys are the letters held down or - for none, and buttons are the left,
+    middle and right mouse buttons as 0 or 1.  each line holds until the
+    tick of the next one"""
+    def __init__(self, path):
+        self.lines = []
+        with open(path) as file:
+            for line in file:
+                line = line.split("#")[0].split()
+                if not line:
+                    continue
+
+                tick, letters, x, y, buttons = line
+                held = []
+                if letters != "-":
+                    held = [getattr(pygame, "K_" + letter) for letter in letters]
+                pressed = tuple(button == "1" for button in buttons)
+                self.lines.append((int(tick), KeySet(held), (int(x), int(y)), pressed))
+
+        self.current = 0
+
+    def get(self, tick):
+        """returns the keys, mouse position and mouse buttons for a tick"""
+        while (self.current + 1 < len(self.lines)
+               and self.lines[self.current + 1][0] <= tick):
+            self.current += 1
+
+        return self.lines[self.current][1:]
+
+
+class BotInput:
+    """input that plays the game, badly, for soak tests
+
+    it heads out of the shop, picks up dropped coins, wanders about shooting
+    the closest hound, grabs corpses and brings them back to sell"""
+    DOOR_X = 7 * TILE_W + TILE_W / 2
+    DOOR_GAP = TILE_H   # how far from the door it wanders, so it won't pay to go in
+    WANDER_TICKS = (20, 60)
+
+    def __init__(self, seed=None):
+        self.random = random.Random(seed)   # separate so the game's rolls don't change
+        self.wander_keys = KeySet()
+        self.next_wander = 0
+        self.corpse_goal = 1
+
+    def towards(self, x, y):
+        """keys for walking to a point, one axis at a time"""
+        center = player.body.pos_center()
+        if x < center[0] - 4:
+            return KeySet((pygame.K_a,))
+        elif x > center[0] + 4:
+            return KeySet((pygame.K_d,))
+        elif y < center[1]:
+            return KeySet((pygame.K_w,))
+        return KeySet((pygame.K_s,))
+
+    def wander(self, tick):
+        if tick >= self.next_wander:
+            self.next_wander = tick + self.random.randint(*self.WANDER_TICKS)
+            letters = self.random.choice(("w", "a", "s", "d", "wa", "wd", "sa", "sd"))
+            self.wander_keys = KeySet(getattr(pygame, "K_" + letter) for letter in letters)
+
+        if player.body.pos_center()[1] < SHOP_ENTER + self.DOOR_GAP:
+            return KeySet(key for key in self.wander_keys.held if key != pygame.K_w)
+        return self.wander_keys
+
+    def get(self, tick):
+        """returns the keys, mouse position and mouse buttons for a tick"""
+        mouse_pos = (int(SCRN_W / 2), int(SCRN_H / 2))
+        shoot = False
+        grab = tick % 2 == 0   # tapping right click picks up and sells
+
+        if player.inShop:
+            if player.corpse_count:
+                keys = KeySet()
+            else:
+                keys = self.towards(self.DOOR_X, SHOP_ENTER + TILE_H)
+                self.corpse_goal = self.random.randint(1, player.MAX_CORPSES)
+
+        elif player.corpse_count >= self.corpse_goal:
+            keys = self.towards(self.DOOR_X, 0)
+
+        else:
+            coin = coin_space.nearest(player.body.pos_center())
+            if coin:
+                keys = self.towards(*coin.body.pos_center())
+            else:
+                keys = self.wander(tick)
+
+            target = enemy_space.nearest(player.body.pos_center(), lambda enemy: not enemy.dead)
+            if target:
+                mouse_pos = camera.pos(target.body.pos_center())
+                shoot = True
+
+        return keys, mouse_pos, (shoot, False, grab)
+
+
+user_input = Input()
+
 # sound
-soundboard = Soundboard()
-soundboard.add("shop.wav")
-soundboard.add("underworld.wav")
-soundboard.add("sell.wav")
-soundboard.add("shoot.wav")
-soundboard.add("hitwall.wav")
-soundboard.add("yelp.wav")
-soundboard.add("squelch1.wav")
-soundboard.add("squelch2.wav")
-soundboard.add("squelch3.wav")
-soundboard.add("collect.wav")
-soundboard.add("steal.wav")
+music = Music()
+music.add("shop.wav")
+music.add("underworld.wav")
 MUSIC_SHOP = 0
 MUSIC_UNDERWORLD = 1
-SOUND_SELL = 2
-SOUND_SHOOT = 3
-SOUND_HITWALL = 4
-SOUND_SQUELCH = (5, 6, 7)
-SOUND_YELP = 8
-SOUND_COLLECT = 9
-SOUND_STEAL = 10
-
-# level
-SHOP_ENTER = 6 * TILE_H
-SHOP_ENTER_TILE = 5
 
-level_background = load_image("level.png")
-level_background.set_colorkey(GREEN)
+soundboard = Soundboard(len(music.tracks))
+soundboard.add("sell.wav", limit=1, priority=3)
+soundboard.add("shoot.wav", limit=3, priority=2)
+soundboard.add("hitwall.wav")
+soundboard.add("yelp.wav", limit=1)
+soundboard.add("squelch1.wav", limit=1)
+soundboard.add("squelch2.wav", limit=1)
+soundboard.add("squelch3.wav", limit=1)
+soundboard.add("collect.wav", limit=3, priority=1)
+soundboard.add("steal.wav", limit=1, priority=3)
+SOUND_SELL = 0
+SOUND_SHOOT = 1
+SOUND_HITWALL = 2
+SOUND_SQUELCH = (3, 4, 5)
+SOUND_YELP = 6
+SOUND_COLLECT = 7
+SOUND_STEAL = 8
 
-grid = Grid(15, 20)
-grid.change_rect(0, SHOP_ENTER_TILE, 15, 1, PLAYER_WALL)   # outline
-grid.change_rect(0, SHOP_ENTER_TILE, 1, 15, PLAYER_WALL)
-grid.change_rect(0, SHOP_ENTER_TILE + 14, 15, 1, PLAYER_WALL)
-grid.change_rect(14, SHOP_ENTER_TILE, 1, 15, PLAYER_WALL)
+# level
+level = Level.load("underworld")
 
-grid.change_point(3, SHOP_ENTER_TILE + 3, ALL_WALL)   # pillars
-grid.change_point(3, SHOP_ENTER_TILE + 11, ALL_WALL)
-grid.change_point(11, SHOP_ENTER_TILE + 3, ALL_WALL)
-grid.change_point(11, SHOP_ENTER_TILE + 11, ALL_WALL)
+SHOP_COL, SHOP_ROW, SHOP_W, SHOP_H = level.shop
+SHOP_ENTER_TILE = SHOP_ROW + SHOP_H - 1   # the shop's bottom wall, with the door in it
+SHOP_ENTER = (SHOP_ROW + SHOP_H) * TILE_H
 
-grid.change_rect(3, 0, 8, 1, ALL_WALL)   # shop walls
-grid.change_rect(3, 0, 1, SHOP_ENTER_TILE, ALL_WALL)
-grid.change_rect(11, 0, 1, SHOP_ENTER_TILE, ALL_WALL)
-grid.change_rect(3, SHOP_ENTER_TILE, 9, 1, ALL_WALL)
+level_background = loader.submit(load_image, level.background, GREEN)
 
-grid.change_rect(7, 1, 4, 1, ALL_WALL)   # shop collidables
-grid.change_rect(4, 3, 3, 1, ALL_WALL)
-grid.change_rect(8, 3, 3, 1, ALL_WALL)
-grid.change_rect(9, 3, 1, 2, ALL_WALL)
-grid.change_rect(6, SHOP_ENTER_TILE, 3, 1, ENEMY_WALL)   # shop entrance
+grid = Grid(level.width, level.height, level.tiles)
 
-grid.create_surf()
+bullet_space = SpatialHash()
+coin_space = SpatialHash()
+enemy_space = SpatialHash()   # the live hounds
+corpse_space = SpatialHash()   # the dead ones lying around to be picked up
+hound_paths = FlowField(grid, ENEMY)   # every hound's way to the player
 
-SHOP_CENTER = (int(grid.FULL_W / 2), int(SHOP_ENTER / 2))
-SHOP_LEFT_WALL = TILE_W * 3
-SHOP_RIGHT_WALL = TILE_W * 12
+SHOP_CENTER = (int((SHOP_COL + SHOP_W / 2) * TILE_W), int((SHOP_ROW + SHOP_H / 2) * TILE_H))
+SHOP_LEFT_WALL = TILE_W * SHOP_COL
+SHOP_RIGHT_WALL = TILE_W * (SHOP_COL + SHOP_W)
+PORTAL_POS = tuple(level.props["portal"])
 
 # sprites and entities
 enemyHandler = EnemyHandler()
 
 PLAYER_SPRITE_SHEET = Spritesheet("player.png", 6, 9, (4, 4, 4, 4, 4))
-player = Player(540, 115, PIXEL*6, PIXEL*4, 0, 0)
+player = Player(level.props["player"][0], level.props["player"][1], PIXEL*6, PIXEL*4, 0, 0)
 PLAYER_SPRITE_SHEET.init_z_height(player.body.gridbox)
 IDLE = 0
 
@@ -1668,10 +3937,18 @@ coin_counter_sprite = SpriteInstance(COIN_SPRITE_SHEET)
 
 UNDERWORLD_KING_SHEET = Spritesheet("underworld_king.png", 32, 32, (1,))
 
+bullet_pool = Pool(Bullet)
+coin_pool = Pool(Coin)
+hound_pool = Pool(Shadowhound)
+registry = Registry({BULLETS: bullet_pool, DYING_BULLETS: bullet_pool,
+                     COINS: coin_pool, HOUNDS: hound_pool, CORPSES: hound_pool})
+
 # misc
 SHOP_END = 1
 DEATH_END = 2
 
+dirty = DirtyRects(DIRTY_RECTS)
+timestep = Timestep(fixed=args.fast)
 camera = Camera()
 pinhole = Pinhole()
 pinhole.set_radius(0)
@@ -1681,10 +3958,11 @@ text_handler = TextHandler()
 PORTAL_SHEET = Spritesheet("portal_frame.png", 56, 44, (12,))
 PORTAL = SpriteInstance(PORTAL_SHEET)
 
+ending = 0
+underworld_king = None
+
+
 def menu_loop():
-    global keys
-    global mouse_pos
-    global mouse_pressed
     global tutorial
 
     camera.body.goto(SHOP_CENTER[0], SHOP_CENTER[1])
@@ -1700,21 +3978,26 @@ def menu_loop():
     text_handler.add("Play Intro/Tutorial", (menu_x, play_y), False, True)
     text_handler.add("Skip Intro/Tutorial", (menu_x, skip_y), False, True)
 
+    timestep.reset()
     while True:
-        mouse_pos = pygame.mouse.get_pos()
-        mouse_pressed = pygame.mouse.get_pressed()
-        keys = pygame.key.get_pressed()
+        mouse_pos = user_input.state.mouse_pos
+        mouse_pressed = user_input.state.buttons
+
+        for _ in timestep.ticks():
+            pinhole.update()
+            text_handler.update()
 
         grid.draw(postSurf)
 
-        position = player.body.x, player.body.y - player.sprite.sheet.z_height
-        postSurf.blit(player.sprite.get_now_frame(), camera.pos(position))
+        x, y = player.body.lerp_pos()
+        position = x, y - player.sprite.sheet.z_height
+        dirty.blit(postSurf, player.sprite.get_now_frame(), camera.view(position))
 
-        pinhole.update()
+        pinhole.draw()
         # debug(1, pinhole.radius)
         
         if button_play.collidepoint(mouse_pos[0], mouse_pos[1] - 1):
-            pygame.draw.rect(postSurf, DARK_GREY, button_play)
+            dirty.add(pygame.draw.rect(postSurf, DARK_GREY, button_play))
             if mouse_pressed[0]:
                 text_handler.delete(1)
                 text_handler.delete(0)
@@ -1722,7 +4005,7 @@ def menu_loop():
                 break
 
         elif button_skip.collidepoint(mouse_pos[0], mouse_pos[1] - 1):
-            pygame.draw.rect(postSurf, DARK_GREY, button_skip)
+            dirty.add(pygame.draw.rect(postSurf, DARK_GREY, button_skip))
 
             if mouse_pressed[0]:
                 text_handler.delete(1)
@@ -1730,7 +4013,7 @@ def menu_loop():
                 tutorial = False
                 break
 
-        text_handler.update()
+        text_handler.draw()
 
         update()
 
@@ -1816,19 +4099,14 @@ def intro_cutscene():
                 ("...", player_text_pos, 120))
 
     alpha = 255
-    for text in dialogue:
-        text_handler.add(text[0], text[1], True, True, text[2])
-
-        while text_handler.texts:
-            grid.draw(postSurf)
-
-            pos = player.body.x, player.body.y - player.sprite.sheet.z_height
-            postSurf.blit(player.sprite.get_now_frame(), camera.pos(pos))
-
-            postSurf.blit(king_sheet.get_frame(0, 0), (king_x, king_y))
+    line = 0
+    text = dialogue[line]
+    text_handler.add(text[0], text[1], True, True, text[2])
 
+    timestep.reset()
+    while text_handler.texts:
+        for _ in timestep.ticks():
             PORTAL.delay_next(4)
-            postSurf.blit(PORTAL.get_now_frame(), camera.pos((78 * PIXEL, 42 * PIXEL)))
 
             if king_y_delay < king_y_cycle[king_y_current][0]:
                 king_y_delay += 1
@@ -1837,243 +4115,334 @@ def intro_cutscene():
                 king_y += king_y_cycle[king_y_current][1]
                 king_y_current = (king_y_current + 1) % 12
 
-            if text[1] is king_text_pos:
-                text_handler.update(True)
-            else:
-                text_handler.update()
+            text_handler.update()
 
             if text is dialogue[-3]:
                 alpha -= 5
-                UNDERWORLD_KING_SHEET.surface.set_alpha(alpha)
+                UNDERWORLD_KING_SHEET.set_alpha(alpha)
 
             pinhole.update()
 
-            update()
+            if not text_handler.texts and line < len(dialogue) - 1:
+                line += 1
+                text = dialogue[line]
+                text_handler.add(text[0], text[1], True, True, text[2])
 
-    UNDERWORLD_KING_SHEET.surface.set_alpha(255)
+        grid.draw(postSurf)
 
+        x, y = player.body.lerp_pos()
+        pos = x, y - player.sprite.sheet.z_height
+        dirty.blit(postSurf, player.sprite.get_now_frame(), camera.view(pos))
 
-def tutorial_loop():
-    global tutorial
-    global keys
-    global mouse_pos
-    global mouse_pressed
-    global right_mouse_released
+        dirty.blit(postSurf, king_sheet.get_frame(0, 0), (king_x, king_y))
+
+        dirty.blit(postSurf, PORTAL.get_now_frame(), camera.view(PORTAL_POS))
+
+        text_handler.draw(text[1] is king_text_pos)
+
+        pinhole.draw()
+
+        update()
+
+    UNDERWORLD_KING_SHEET.set_alpha(255)
+
+
+# everything that changes while the game's going, for keyframes
+WORLD = ("rng", "bullet_space", "coin_space", "enemy_space", "corpse_space", "enemyHandler",
+         "player", "fairy_sprite", "coin_handler", "coin_counter", "coin_counter_sprite",
+         "bullet_pool", "coin_pool", "hound_pool", "registry", "camera", "pinhole",
+         "screen_fade", "text_handler", "PORTAL", "ending", "underworld_king")
+
+
+class WorldPickler(pickle.Pickler):
+    """pickles the world, leaving out what's the same in every game
+
+    the grid and the spritesheets get written as names to look up again.
+    so does the body store, since bodies read its columns straight through
+    and it has to be loaded back into in place"""
+    def persistent_id(self, obj):
+        if obj is grid:
+            return "grid"
+        if obj is bodies:
+            return "bodies"
+        if isinstance(obj, Spritesheet):
+            return obj.sheet_path
+        return None
+
+
+class WorldUnpickler(pickle.Unpickler):
+    """loads a pickled world back, out of a replay that came from who knows where
+
+    so it only makes the game's own classes and the couple of others a world
+    has in it, and anything else a pickle asks for is refused"""
+    OTHERS = {("random", "Random"), ("pygame", "__rect_constructor")}
+
+    def find_class(self, module, name):
+        if module == __name__ and "." not in name:
+            found = globals().get(name)
+            if isinstance(found, type) and found.__module__ == __name__:
+                return found
+        elif (module, name) in self.OTHERS:
+            return super().find_class(module, name)
+
+        raise pickle.UnpicklingError("a world can't have a %s.%s in it" % (module, name))
+
+    def persistent_load(self, name):
+        if name == "grid":
+            return grid
+        if name == "bodies":
+            return bodies
+        return Spritesheet.sheets[name]
+
+
+def save_world():
+    """returns a keyframe of the world, as it is between ticks"""
+    file = io.BytesIO()
+    world = {name: globals()[name] for name in WORLD}
+    # the tick that's started hasn't run yet
+    keyframe = (timestep.tick - 1, bodies.snapshot(), world)
+    WorldPickler(file, pickle.HIGHEST_PROTOCOL).dump(keyframe)
+    return file.getvalue()
+
+
+def load_world(keyframe):
+    """puts the world back the way it was in a keyframe"""
+    tick, columns, world = WorldUnpickler(io.BytesIO(keyframe)).load()
+    globals().update(world)
+    bodies.restore(columns)
+    timestep.tick = tick
+
+
+def game_tick():
+    """runs one tick of the game, returns True once the game is over"""
     global ending
+    global underworld_king
 
-    tutorial = True
+    if replay is not None and not replay.step(user_input):
+        return True   # the replay's run out
 
-    enemyHandler.MAX_ENEMIES = 1
+    enemyHandler.update()
+    player.update()
 
-    soundboard.play(MUSIC_SHOP, -1)
-    soundboard.play(MUSIC_UNDERWORLD, -1)
-    soundboard.sounds[MUSIC_UNDERWORLD].set_volume(0)
-    soundboard.already_playing = True
+    PORTAL.delay_next(4)
 
-    camera.change_focus(player.body)
+    camera.handle()
 
-    pinhole.stop_breathing()
+    coin_handler.update_coins()
+    registry.flush()   # everything destroyed this tick goes now
 
-    right_mouse_last = False
-    right_mouse_released = False
+    # check for lose conditions
+    if not ending:
+        if coin_handler.coin_count == 0:
+            if player.inShop and player.corpse_count == 0:
+                ending = SHOP_END
+            elif not player.inShop:
+                ending = DEATH_END
+                enemyHandler.kill_all()
+                enemyHandler.spawning = False
+                underworld_king = UnderworldKing()
 
-    ending = 0
-    underworld_king = None
+    elif ending == DEATH_END:
+        underworld_king.update()
 
-    text_handler.add("WASD to move.", (350, 100))
+        if underworld_king.collide_player():
+            return True
 
-    tutorial_stage = 0
+    elif ending == SHOP_END:
+        screen_fade.fade_to_black()
+        if screen_fade.transparency == 255:
+            return True
 
-    while True:
-        # mouse handling & right click flag
-        mouse_pos = pygame.mouse.get_pos()
-        mouse_pressed = pygame.mouse.get_pressed()
+    if pinhole.radius > 100:
+        pinhole.set_position((int(SCRN_W / 2), int(SCRN_H / 2)))
+        pinhole.set_alpha(200)
+    pinhole.update()
 
-        if right_mouse_released:
-            right_mouse_released = False
-        if right_mouse_last and not mouse_pressed[2]:
-            right_mouse_released = True
-        right_mouse_last = mouse_pressed[2]
+    coin_counter.update()
+    # coin_counter_sprite.delay_next(6)
 
-        keys = pygame.key.get_pressed()
+    text_handler.update()
+    screen_fade.update()
 
-        grid.draw(postSurf)
-        enemyHandler.update()
-        if tutorial_stage == 0 and not player.inShop:
-            tutorial_stage = 1
-            text_handler.delete(0)
-            text_handler.add("Left click to shoot.", (330, 500))
-            text_handler.add("Careful not to let your coins get stolen.", (220, 530))
+    user_input.seen()   # only the first tick sees the click
+    return False
 
-        elif tutorial_stage == 1 and enemyHandler.enemy_count == 1 and enemyHandler.enemies[0].dead:
-            tutorial_stage = 2
-            text_handler.delete(1)
-            text_handler.delete(0)
-            text_handler.add("Right click near an enemy to pick it up.", (215, 500))
-            text_handler.add("You can pick up five enemies at once.", (225, 530))
 
-        elif tutorial_stage == 2 and player.corpse_count == 1:
-            tutorial_stage = 3
-            text_handler.delete(1)
+def tutorial_tick():
+    """runs one tick of the tutorial, returns True once it's over"""
+    global tutorial
+    global tutorial_stage
+    global tutorial_timer
+
+    if tutorial_stage == 0 and not player.inShop:
+        tutorial_stage = 1
+        text_handler.delete(0)
+        text_handler.add("Left click to shoot.", (330, 500))
+        text_handler.add("Careful not to let your coins get stolen.", (220, 530))
+
+    elif tutorial_stage == 1 and enemyHandler.enemy_count == 1 and enemyHandler.enemies[0].dead:
+        tutorial_stage = 2
+        text_handler.delete(1)
+        text_handler.delete(0)
+        text_handler.add("Right click near an enemy to pick it up.", (215, 500))
+        text_handler.add("You can pick up five enemies at once.", (225, 530))
+
+    elif tutorial_stage == 2 and player.corpse_count == 1:
+        tutorial_stage = 3
+        text_handler.delete(1)
+        text_handler.delete(0)
+        text_handler.add("Bring the corpse to the shop.", (265, 400))
+
+    elif tutorial_stage == 3 and player.inShop:
+        tutorial_stage = 4
+        text_handler.delete(0)
+        text_handler.add("Right click to sell your corpses.", (265, 100))
+
+    elif tutorial_stage == 4 and user_input.state.released[2]:
+        tutorial_stage = 5
+        text_handler.delete(0)
+        text_handler.add("Well done!  Go make some money.", (260, 100))
+        tutorial_timer = 0
+
+    elif tutorial_stage == 5:
+        if tutorial_timer < 300:
+            tutorial_timer += 1
+        else:
             text_handler.delete(0)
-            text_handler.add("Bring the corpse to the shop.", (265, 400))
+            tutorial = False
+            return True
 
-        elif tutorial_stage == 3 and player.inShop:
-            tutorial_stage = 4
-            text_handler.delete(0)
-            text_handler.add("Right click to sell your corpses.", (265, 100))
+    return game_tick()
 
-        elif tutorial_stage == 4 and right_mouse_released:
-            tutorial_stage = 5
-            text_handler.delete(0)
-            text_handler.add("Well done!  Go make some money.", (260, 100))
-            timer = 0
 
-        elif tutorial_stage == 5:
-            if timer < 300:
-                timer += 1
-            else:
-                text_handler.delete(0)
-                tutorial = False
-                break
+def draw_game():
+    """draws a frame of the game, from back to front"""
+    grid.draw(postSurf)
+    enemyHandler.draw(postSurf)
 
-        PORTAL.delay_next(4)
+    portal_pos = camera.view(PORTAL_POS)
+    if tutorial and not player.inShop:
+        dirty.blit(postSurf, PORTAL.get_now_frame(), portal_pos)
+    player.draw_all(postSurf)
+    if not tutorial or player.inShop:
+        dirty.blit(postSurf, PORTAL.get_now_frame(), portal_pos)
 
-        if not player.inShop:
-            postSurf.blit(PORTAL.get_now_frame(), camera.pos((78 * PIXEL, 42 * PIXEL)))
-        player.update()
-        if player.inShop:
-            postSurf.blit(PORTAL.get_now_frame(), camera.pos((78 * PIXEL, 42 * PIXEL)))
+    coin_handler.draw_coins()
 
-        soundboard.update()
-        camera.handle()
+    if ending == DEATH_END:
+        underworld_king.draw(postSurf)
 
-        coin_handler.update_coins()
+    pinhole.draw()
 
-        # check for lose conditions
-        if not ending:
-            if coin_handler.coin_count == 0:
-                if player.inShop and not player.corpses:
-                    ending = SHOP_END
-                elif not player.inShop:
-                    ending = DEATH_END
-                    enemyHandler.kill_all()
-                    enemyHandler.enemy_count = enemyHandler.MAX_ENEMIES
-                    underworld_king = UnderworldKing()
+    coin_counter.draw(postSurf)
+    dirty.blit(postSurf, coin_counter_sprite.get_now_frame(), (20, 22))
 
-        elif ending == DEATH_END:
-            underworld_king.update()
+    text_handler.draw()
+    screen_fade.draw()
 
-            if underworld_king.collide_player():
-                break
 
-        elif ending == SHOP_END:
-            screen_fade.fade_to_black()
-            if screen_fade.transparency == 255:
-                break
+def tutorial_loop():
+    global tutorial
+    global tutorial_stage
+    global ending
+    global underworld_king
 
-        if pinhole.radius > 100:
-            pinhole.set_position((int(SCRN_W / 2), int(SCRN_H / 2)))
-            pinhole.set_alpha(200)
-        pinhole.update()
+    tutorial = True
+
+    enemyHandler.MAX_ENEMIES = 1
+
+    music.play(MUSIC_SHOP if player.inShop else MUSIC_UNDERWORLD)
+
+    camera.change_focus(player.body)
+
+    pinhole.stop_breathing()
+
+    user_input.seen()   # nothing clicked before the tutorial counts
 
-        coin_counter.update()
-        # coin_counter_sprite.delay_next(6)
-        postSurf.blit(coin_counter_sprite.get_now_frame(), (20, 22))
+    ending = 0
+    if underworld_king is not None:
+        underworld_king.body.release()
+    underworld_king = None
 
-        text_handler.update()
-        screen_fade.update()
+    text_handler.add("WASD to move.", (350, 100))
+
+    tutorial_stage = 0
+
+    timestep.reset()
+    while True:
+        over = False
+        for _ in timestep.ticks():
+            over = tutorial_tick()
+            if over:
+                break
+
+        if over:
+            break
+
+        draw_game()
 
         update()
 
 
-def game_loop():
-    global keys
-    global mouse_pos
-    global mouse_pressed
-    global right_mouse_released
+def start_game():
+    """gets everything ready for the main game"""
+    global tutorial
     global ending
+    global underworld_king
 
     tutorial = False
 
     enemyHandler.MAX_ENEMIES = 7
+    enemyHandler.spawning = True
 
-    if not soundboard.already_playing:
-        soundboard.play(MUSIC_SHOP, -1)
-        soundboard.play(MUSIC_UNDERWORLD, -1)
-        soundboard.sounds[MUSIC_UNDERWORLD].set_volume(0)
+    if not music.playing:
+        music.play(MUSIC_SHOP if player.inShop else MUSIC_UNDERWORLD)
 
     camera.change_focus(player.body)
 
     pinhole.stop_breathing()
 
-    right_mouse_last = False
-    right_mouse_released = False
+    user_input.seen()   # nothing clicked before the game counts
 
     ending = 0
+    if underworld_king is not None:
+        underworld_king.body.release()
     underworld_king = None
 
-    while True:
-        # mouse handling & right click flag
-        mouse_pos = pygame.mouse.get_pos()
-        mouse_pressed = pygame.mouse.get_pressed()
-
-        if right_mouse_released:
-            right_mouse_released = False
-        if right_mouse_last and not mouse_pressed[2]:
-            right_mouse_released = True
-        right_mouse_last = mouse_pressed[2]
+    if replay is not None and replay.playing and args.seek:
+        seek(int(args.seek * FPS))
 
-        keys = pygame.key.get_pressed()
-
-        grid.draw(postSurf)
-        enemyHandler.update()
-        player.update()
-
-        PORTAL.delay_next(4)
-        if not player.inShop:
-            postSurf.blit(PORTAL.get_now_frame(), camera.pos((78 * PIXEL, 42 * PIXEL)))
-        if player.inShop:
-            postSurf.blit(PORTAL.get_now_frame(), camera.pos((78*PIXEL, 42*PIXEL)))
 
-        soundboard.update()
-        camera.handle()
+def seek(tick):
+    """skips a replay to a tick, from the keyframe before it"""
+    if not len(replay):
+        return
 
-        coin_handler.update_coins()
+    tick = max(tick, 0)   # seeking back past the start just starts from the start
+    load_world(replay.rewind(tick))
+    while replay.position < tick:
+        timestep.tick += 1
+        if game_tick():
+            break
 
-        # check for lose conditions
-        if not ending:
-            if coin_handler.coin_count == 0:
-                if player.inShop and not player.corpses:
-                    ending = SHOP_END
-                elif not player.inShop:
-                    ending = DEATH_END
-                    enemyHandler.kill_all()
-                    enemyHandler.enemy_count = enemyHandler.MAX_ENEMIES
-                    underworld_king = UnderworldKing()
+    music.play(MUSIC_SHOP if player.inShop else MUSIC_UNDERWORLD)
 
-        elif ending == DEATH_END:
-            underworld_king.update()
 
-            if underworld_king.collide_player():
-                break
+def game_loop():
+    start_game()
 
-        elif ending == SHOP_END:
-            screen_fade.fade_to_black()
-            if screen_fade.transparency == 255:
+    timestep.reset()
+    while True:
+        over = False
+        for _ in timestep.ticks():
+            over = game_tick()
+            if over:
                 break
 
-        if pinhole.radius > 100:
-            pinhole.set_position((int(SCRN_W / 2), int(SCRN_H / 2)))
-            pinhole.set_alpha(200)
-        pinhole.update()
-
-        coin_counter.update()
-        # coin_counter_sprite.delay_next(6)
-        postSurf.blit(coin_counter_sprite.get_now_frame(), (20, 22))
+        if over:
+            break
 
-        text_handler.update()
-        screen_fade.update()
+        draw_game()
 
         # debug(0, player.exitShop)
         # debug(1, screen_fade.transparency)
@@ -2099,11 +4468,48 @@ def game_loop():
         update()
 
 
-pygame.time.wait(2000)
-menu_loop()
+def headless_loop(ticks, source):
+    """runs the game's logic as fast as it can, without drawing or waiting
+
+    input comes from source instead of the mouse and keyboard, or from the
+    replay being played if there's no source"""
+    start_game()
+
+    start = time.perf_counter()
+    tick = 0
+    while tick < ticks:
+        if source:
+            user_input.feed(*source.get(tick))
+
+        tick += 1
+        timestep.tick += 1
+        if game_tick():
+            break
+
+    elapsed = time.perf_counter() - start
+    print("%d ticks in %.2fs, %.0f ticks per second" % (tick, elapsed, tick / elapsed))
+    print("coins %d, in the world %d, enemies %d, ending %d"
+          % (player.coins, coin_handler.coin_count, len(enemyHandler.enemies), ending))
+    for pool in (bullet_pool, coin_pool, hound_pool):
+        print(pool.stats())
+
+
+if args.headless:
+    if replay is not None and replay.playing:
+        headless_loop(len(replay), None)
+    elif args.script:
+        headless_loop(args.ticks, InputScript(args.script))
+    else:
+        headless_loop(args.ticks, BotInput(args.seed))
+
+elif replay is not None:
+    game_loop()   # replays only cover the game, not the menu or tutorial
+
+else:
+    menu_loop()
 
-if tutorial:
-    intro_cutscene()
-    tutorial_loop()
+    if tutorial:
+        intro_cutscene()
+        tutorial_loop()
 
-game_loop()
+    game_loop()